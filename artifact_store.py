@@ -0,0 +1,273 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# Content-addressed storage for job inputs and outputs. Each distinct content
+# is written once to <store>/blobs/<aa>/<sha256>; the names the site serves
+# (temp/..., outputs/... under the static root) are hard links to that blob,
+# so any number of names cost one copy on disk. When the static root is on
+# another filesystem the names fall back to copies.
+#
+# A small SQLite index maps names to blobs and records each blob's size and
+# last access, so lookups never scan directories and the LRU order survives
+# restarts. Access times are batched to the index rather than written per
+# hit. Blobs idle for longer than max_age_s, then the least recently used
+# ones, are evicted together with their names until the store is under
+# max_bytes; this runs at startup, after each put and on each periodic
+# flush. Files that predate the store are adopted at startup as pinned and
+# are never evicted; blobs a running job still needs are held.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (sha TEXT PRIMARY KEY, size INTEGER, created REAL, accessed REAL, pinned INTEGER);
+CREATE TABLE IF NOT EXISTS names (name TEXT PRIMARY KEY, sha TEXT);
+"""
+
+class Blob:
+    def __init__(self, sha, size, created, accessed, pinned):
+        self.sha = sha
+        self.size = size
+        self.created = created
+        self.accessed = accessed
+        self.pinned = pinned
+        self.names = set()
+
+class ArtifactStore:
+    def __init__(self, root, store_dir, max_bytes, max_age_s, subdirs=("temp", "outputs"), flush_interval_s=30.0):
+        self.root = root
+        self.blob_dir = os.path.join(store_dir, "blobs")
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.subdirs = subdirs
+        self.flush_interval_s = flush_interval_s
+        self.lock = threading.RLock()
+        self.blobs = OrderedDict()  # sha -> Blob, least recently used first
+        self.names = {}  # name relative to root -> sha
+        self.held = {}  # sha -> count of jobs still needing it
+        self.touched = set()  # shas whose access time is not yet in the index
+        self.last_flush = time.monotonic()
+        self.total = 0
+        self.stats = {"puts": 0, "dedup_hits": 0, "evicted": 0, "evicted_bytes": 0}
+        os.makedirs(self.blob_dir, exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(store_dir, "index.sqlite"), check_same_thread=False)
+        self.db.executescript(SCHEMA)
+        self.load_index()
+        self.scan()
+        # Over budget from an earlier run or a smaller max_bytes: trim now
+        # rather than at the next put
+        self.evict()
+
+    def blob_path(self, sha):
+        return os.path.join(self.blob_dir, sha[:2], sha)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def load_index(self):
+        rows = self.db.execute("SELECT sha, size, created, accessed, pinned FROM blobs ORDER BY accessed").fetchall()
+        for sha, size, created, accessed, pinned in rows:
+            if not os.path.exists(self.blob_path(sha)):
+                continue
+            self.blobs[sha] = Blob(sha, size, created, accessed, bool(pinned))
+            self.total += size
+        for name, sha in self.db.execute("SELECT name, sha FROM names").fetchall():
+            if sha in self.blobs and os.path.exists(self.path(name)):
+                self.names[name] = sha
+                self.blobs[sha].names.add(name)
+        # Drop rows for anything removed behind the store's back
+        with self.db:
+            self.db.execute("DELETE FROM names")
+            self.db.executemany("INSERT INTO names VALUES (?, ?)", self.names.items())
+            self.db.execute("DELETE FROM blobs")
+            self.db.executemany("INSERT INTO blobs VALUES (?, ?, ?, ?, ?)",
+                                [(b.sha, b.size, b.created, b.accessed, int(b.pinned)) for b in self.blobs.values()])
+
+    def scan(self):
+        # Startup only: adopt files under the served subdirectories that the
+        # index does not know yet (checked-in demo images, older outputs).
+        # Identical ones collapse onto one blob.
+        for subdir in self.subdirs:
+            top = os.path.join(self.root, subdir)
+            os.makedirs(top, exist_ok=True)
+            for dirpath, _, files in os.walk(top):
+                for fname in files:
+                    full = os.path.join(dirpath, fname)
+                    if fname.endswith(".tmp"):
+                        os.remove(full)
+                        continue
+                    name = os.path.relpath(full, self.root).replace(os.sep, "/")
+                    if name not in self.names:
+                        self.adopt(name)
+
+    def adopt(self, name):
+        full = self.path(name)
+        h = hashlib.sha256()
+        with open(full, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        sha = h.hexdigest()
+        with self.lock:
+            if sha not in self.blobs:
+                blob = self.blob_path(sha)
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                self.place(full, blob)
+                self.add_blob(sha, os.path.getsize(blob), pinned=True)
+            else:
+                self.blobs[sha].pinned = True
+                self.db.execute("UPDATE blobs SET pinned = 1 WHERE sha = ?", (sha,))
+            self.link(sha, name)
+            self.db.commit()
+        return sha
+
+    def place(self, src, dest):
+        # Hard link src at dest, atomically replacing dest; copy across filesystems
+        if os.path.exists(dest) and os.path.samefile(src, dest):
+            return
+        tmp = "%s.%s.tmp" % (dest, uuid.uuid4().hex[:8])
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        try:
+            os.replace(tmp, dest)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def add_blob(self, sha, size, pinned=False):
+        # Caller holds self.lock
+        now = time.time()
+        self.blobs[sha] = Blob(sha, size, now, now, pinned)
+        self.total += size
+        self.db.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?)", (sha, size, now, now, int(pinned)))
+
+    def link(self, sha, name):
+        # Caller holds self.lock. Points name at the blob, replacing what it named before.
+        dest = self.path(name)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        self.place(self.blob_path(sha), dest)
+        old = self.names.get(name)
+        if old is not None and old != sha and old in self.blobs:
+            self.blobs[old].names.discard(name)
+        self.names[name] = sha
+        self.blobs[sha].names.add(name)
+        self.db.execute("INSERT OR REPLACE INTO names VALUES (?, ?)", (name, sha))
+
+    def put(self, name, data):
+        # Stores data under name and returns its sha256; content already in
+        # the store only gains a link
+        sha = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            self.stats["puts"] += 1
+            if sha in self.blobs:
+                self.stats["dedup_hits"] += 1
+                self.touch_blob(sha)
+            else:
+                blob = self.blob_path(sha)
+                os.makedirs(os.path.dirname(blob), exist_ok=True)
+                tmp = "%s.%s.tmp" % (blob, uuid.uuid4().hex[:8])
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                os.replace(tmp, blob)
+                self.add_blob(sha, len(data))
+            if self.names.get(name) != sha:
+                self.link(sha, name)
+            self.db.commit()
+            self.evict(keep=sha)
+        return sha
+
+    def lookup(self, name):
+        # sha256 of a stored name, or None; counts as an access
+        with self.lock:
+            sha = self.names.get(name)
+            if sha is not None:
+                self.touch_blob(sha)
+            return sha
+
+    def touch_blob(self, sha):
+        # Caller holds self.lock
+        blob = self.blobs[sha]
+        blob.accessed = time.time()
+        self.blobs.move_to_end(sha)
+        self.touched.add(sha)
+        if time.monotonic() - self.last_flush >= self.flush_interval_s:
+            # Reads also expire idle blobs, so a store nobody writes to still
+            # honours max_age_s
+            self.flush()
+            self.evict(keep=sha)
+
+    def flush(self):
+        with self.lock:
+            rows = [(self.blobs[sha].accessed, sha) for sha in self.touched if sha in self.blobs]
+            self.touched.clear()
+            self.last_flush = time.monotonic()
+            if rows:
+                with self.db:
+                    self.db.executemany("UPDATE blobs SET accessed = ? WHERE sha = ?", rows)
+
+    def hold(self, sha):
+        with self.lock:
+            self.held[sha] = self.held.get(sha, 0) + 1
+
+    def release(self, sha):
+        with self.lock:
+            count = self.held.get(sha, 0) - 1
+            if count > 0:
+                self.held[sha] = count
+            else:
+                self.held.pop(sha, None)
+
+    def evict(self, keep=None):
+        # Oldest access first: drop blobs idle past max_age_s, then keep
+        # dropping until the total fits in max_bytes. `keep` is never dropped.
+        with self.lock:
+            cutoff = time.time() - self.max_age_s
+            victims = []
+            total = self.total
+            for sha, blob in self.blobs.items():
+                if total <= self.max_bytes and blob.accessed >= cutoff:
+                    break
+                if blob.pinned or sha in self.held or sha == keep:
+                    continue
+                victims.append(blob)
+                total -= blob.size
+            for blob in victims:
+                self.remove(blob)
+            if victims:
+                self.db.commit()
+
+    def remove(self, blob):
+        # Caller holds self.lock
+        for name in blob.names:
+            self.names.pop(name, None)
+            try:
+                os.remove(self.path(name))
+            except FileNotFoundError:
+                pass
+            self.db.execute("DELETE FROM names WHERE name = ?", (name,))
+        try:
+            os.remove(self.blob_path(blob.sha))
+        except FileNotFoundError:
+            pass
+        self.db.execute("DELETE FROM blobs WHERE sha = ?", (blob.sha,))
+        del self.blobs[blob.sha]
+        self.touched.discard(blob.sha)
+        self.total -= blob.size
+        self.stats["evicted"] += 1
+        self.stats["evicted_bytes"] += blob.size
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats.update({"blobs": len(self.blobs), "names": len(self.names), "bytes": self.total,
+                          "max_bytes": self.max_bytes, "max_age_s": self.max_age_s,
+                          "pinned": sum(1 for b in self.blobs.values() if b.pinned), "held": len(self.held)})
+        return stats
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,172 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+# Resized, re-encoded variants of the gallery images, generated on first
+# request and kept in a disk cache. A variant's file name is the SHA-256 of
+# the source bytes plus its parameters, so a changed source never serves a
+# stale variant and identical sources share their variants. Least recently
+# used files are evicted once the cache passes max_bytes.
+
+WIDTH_BUCKETS = (160, 320, 480, 640, 960, 1280)
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+
+def width_bucket(width):
+    # Smallest bucket that covers the requested width
+    for bucket in WIDTH_BUCKETS:
+        if width <= bucket:
+            return bucket
+    return WIDTH_BUCKETS[-1]
+
+class ImageVariantCache:
+    def __init__(self, cache_dir, max_bytes, quality=80):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.quality = quality
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # file name -> size, least recently used first
+        self.total = 0
+        self.source_hashes = {}  # path -> ((mtime_ns, size), sha256 hex)
+        self.source_widths = {}  # sha256 hex -> pixel width
+        self.pending = {}  # file name -> lock held while it is generated
+        os.makedirs(cache_dir, exist_ok=True)
+        self.load_entries()
+
+    def load_entries(self):
+        # Rebuild the LRU order from modification times; hits touch their file
+        files = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".tmp"):
+                os.remove(os.path.join(self.cache_dir, name))
+                continue
+            st = os.stat(os.path.join(self.cache_dir, name))
+            files.append((st.st_mtime, name, st.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total += size
+
+    def source_hash(self, path):
+        st = os.stat(path)
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self.source_hashes.get(path)
+        if cached and cached[0] == key:
+            return cached[1]
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        digest = h.hexdigest()
+        self.source_hashes[path] = (key, digest)
+        return digest
+
+    def source_width(self, path):
+        digest = self.source_hash(path)
+        if digest not in self.source_widths:
+            with Image.open(path) as im:
+                self.source_widths[digest] = im.width
+        return self.source_widths[digest]
+
+    def variant_path(self, path, width, fmt):
+        # Returns (cache file path, media type), generating the file on a miss
+        digest = self.source_hash(path)
+        width = min(width_bucket(width), self.source_width(path))
+        name = "%s_w%d_q%d.%s" % (digest[:40], width, self.quality, fmt)
+        full = os.path.join(self.cache_dir, name)
+        with self.lock:
+            if name in self.entries:
+                self.entries.move_to_end(name)
+                hit = True
+            else:
+                hit = False
+                gen_lock = self.pending.setdefault(name, threading.Lock())
+        if hit:
+            try:
+                os.utime(full)
+            except FileNotFoundError:
+                pass  # evicted meanwhile; open_variant builds it again
+            return full, FORMATS[fmt][1]
+        # One request encodes a missing variant; concurrent ones wait for it
+        with gen_lock:
+            with self.lock:
+                done = name in self.entries
+            if not done:
+                try:
+                    data = self.encode(path, width, fmt)
+                    tmp = full + ".tmp"
+                    with open(tmp, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp, full)
+                finally:
+                    with self.lock:
+                        self.pending.pop(name, None)
+                with self.lock:
+                    self.entries[name] = len(data)
+                    self.total += len(data)
+                    self.evict(keep=name)
+        return full, FORMATS[fmt][1]
+
+    def open_variant(self, path, width, fmt):
+        # (open file, media type). Once open, eviction cannot take the variant
+        # from under a response; one evicted before the open is built again.
+        for _ in range(3):
+            full, mimetype = self.variant_path(path, width, fmt)
+            try:
+                return open(full, "rb"), mimetype
+            except FileNotFoundError:
+                self.forget(os.path.basename(full))
+        raise FileNotFoundError(full)
+
+    def forget(self, name):
+        with self.lock:
+            size = self.entries.pop(name, None)
+            if size is not None:
+                self.total -= size
+
+    def encode(self, path, width, fmt):
+        with Image.open(path) as im:
+            im.load()
+            if im.width > width:
+                im = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+            if fmt == "jpeg" and im.mode not in ("RGB", "L"):
+                # JPEG has no alpha: flatten onto white
+                rgba = im.convert("RGBA")
+                im = Image.new("RGB", rgba.size, (255, 255, 255))
+                im.paste(rgba, mask=rgba.getchannel("A"))
+            elif fmt == "webp" and im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGBA" if "A" in im.getbands() else "RGB")
+            out = io.BytesIO()
+            if fmt == "webp":
+                options = {"quality": self.quality, "method": 4}
+            else:
+                options = {"quality": self.quality, "optimize": True, "progressive": True}
+            im.save(out, FORMATS[fmt][0], **options)
+            return out.getvalue()
+
+    def evict(self, keep):
+        # Caller holds self.lock
+        while self.total > self.max_bytes and len(self.entries) > 1:
+            name, size = next(iter(self.entries.items()))
+            if name == keep:
+                break
+            del self.entries[name]
+            self.total -= size
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+
+    def srcset_widths(self, path):
+        # Buckets below the source width, plus the source width itself when no
+        # bigger than the largest bucket (images are never upscaled)
+        source = self.source_width(path)
+        widths = [w for w in WIDTH_BUCKETS if w < source]
+        if source <= WIDTH_BUCKETS[-1]:
+            widths.append(source)
+        return widths
+
+    def get_stats(self):
+        with self.lock:
+            return {"files": len(self.entries), "bytes": self.total, "max_bytes": self.max_bytes}
@@ -1,36 +1,77 @@
+import atexit
 import os
+import sys
 import json
-from flask import Flask, jsonify
-import smbus2
+import time
+from flask import Flask, jsonify, request
 import threading
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from i2c_bus import bus_manager
+from sample_store import SampleStore
+
 # Configuration from environment variables
 I2C_BUS_NUMBER = int(os.environ.get("I2C_BUS_NUMBER", "1"))
 I2C_ADDRESS = int(os.environ.get("I2C_ADDRESS", "0x18"), 16)
 HTTP_HOST = os.environ.get("HTTP_HOST", "0.0.0.0")
 HTTP_PORT = int(os.environ.get("HTTP_PORT", "8080"))
+SAMPLING_INTERVAL_MS = int(os.environ.get("SAMPLING_INTERVAL_MS", "1000"))
+
+# Durable history (see sample_store.py), off unless HISTORY_DIR is set; when
+# it is, start() runs a sampler every SAMPLING_INTERVAL_MS. A relative
+# HISTORY_DIR is under this driver's directory.
+HISTORY_DIR = os.environ.get("HISTORY_DIR", "")
+HISTORY_SEGMENT_MB = float(os.environ.get("HISTORY_SEGMENT_MB", "4"))
+HISTORY_RETENTION_MB = float(os.environ.get("HISTORY_RETENTION_MB", "256"))
+HISTORY_RETENTION_DAYS = float(os.environ.get("HISTORY_RETENTION_DAYS", "42"))
+HISTORY_FLUSH_S = float(os.environ.get("HISTORY_FLUSH_S", "5"))
+HISTORY_FSYNC_S = float(os.environ.get("HISTORY_FSYNC_S", "30"))
+MAX_HISTORY_SAMPLES = int(os.environ.get("MAX_HISTORY_SAMPLES", "100000"))
 
 # MCP9808 Register Addresses
 MCP9808_REG_AMBIENT_TEMP = 0x05
 
-# Thread lock for I2C access
-i2c_lock = threading.Lock()
+history_store = None
+bus_manager.register(I2C_BUS_NUMBER, I2C_ADDRESS)
 
-def read_temperature():
-    with i2c_lock:
-        bus = smbus2.SMBus(I2C_BUS_NUMBER)
-        try:
-            data = bus.read_i2c_block_data(I2C_ADDRESS, MCP9808_REG_AMBIENT_TEMP, 2)
-        finally:
-            bus.close()
+def read_temperature_raw():
+    # Signed reading in 1/16 C steps
+    with bus_manager.transaction(I2C_BUS_NUMBER) as bus:
+        data = bus.read_i2c_block_data(I2C_ADDRESS, MCP9808_REG_AMBIENT_TEMP, 2)
     t_upper = data[0]
     t_lower = data[1]
     temp = ((t_upper & 0x1F) << 8) | t_lower
     if t_upper & 0x10:
         temp -= 8192
-    celsius = temp * 0.0625
+    return temp
+
+def read_temperature():
+    celsius = read_temperature_raw() * 0.0625
     return round(celsius, 4)
 
+def history_sampling_loop():
+    while True:
+        try:
+            history_store.append(int(time.time() * 1000), read_temperature_raw())
+        except Exception:
+            pass
+        time.sleep(SAMPLING_INTERVAL_MS / 1000.0)
+
+def start_history():
+    global history_store
+    if not HISTORY_DIR:
+        return
+    history_store = SampleStore(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), HISTORY_DIR),
+        segment_bytes=int(HISTORY_SEGMENT_MB * (1 << 20)),
+        retention_bytes=int(HISTORY_RETENTION_MB * (1 << 20)),
+        retention_seconds=HISTORY_RETENTION_DAYS * 86400,
+        flush_interval_s=HISTORY_FLUSH_S,
+        fsync_interval_s=HISTORY_FSYNC_S,
+    )
+    atexit.register(history_store.close)
+    threading.Thread(target=history_sampling_loop, daemon=True).start()
+
 app = Flask(__name__)
 
 @app.route('/sensors/temperature', methods=['GET'])
@@ -41,5 +82,31 @@ def get_temperature():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/sensors/temperature/history', methods=['GET'])
+def get_temperature_history():
+    if history_store is None:
+        return jsonify({"error": "history is disabled (HISTORY_DIR is not set)"}), 404
+    try:
+        t_to = int(request.args.get("to", int(time.time() * 1000)))
+        t_from = int(request.args.get("from", t_to - 3600000))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    timestamps, raw = history_store.query(t_from, t_to)
+    truncated = len(timestamps) > MAX_HISTORY_SAMPLES
+    if truncated:
+        timestamps, raw = timestamps[-MAX_HISTORY_SAMPLES:], raw[-MAX_HISTORY_SAMPLES:]
+    return jsonify({
+        "from": t_from,
+        "to": t_to,
+        "truncated": truncated,
+        "timestamp": timestamps.tolist(),
+        "temperature_celsius": (raw * 0.0625).tolist(),
+    })
+
+def start():
+    # Background work, run once by __main__ or by the I2C gateway
+    start_history()
+
 if __name__ == '__main__':
+    start()
     app.run(host=HTTP_HOST, port=HTTP_PORT)
\ No newline at end of file
@@ -0,0 +1,193 @@
+import ctypes
+import errno
+import fcntl
+import threading
+import time
+from contextlib import contextmanager
+import smbus2
+
+# Shared I2C bus access for the sensor drivers. The manager keeps one open
+# SMBus per bus number for the life of the process and serializes
+# transactions on it. When several drivers run in one process
+# (i2c_gateway.py) they all import this module once, so every device on a
+# bus goes through the same handle and lock.
+#
+# Conversion timing: conversion() starts a measurement in one transaction,
+# sleeps out the device's conversion time with the bus free for the other
+# devices, and collects the result in a second transaction, polling again
+# while the device NACKs. Drivers register their address on a bus; once a
+# bus has more than one device, shared() tells a driver to prefer such
+# split conversions over clock-stretched reads that hold the bus meanwhile.
+#
+# RdwrTransfer issues raw I2C_RDWR ioctls on the managed handle's fd: a
+# write and a read joined by a repeated start in one ioctl, or either half
+# alone, through ctypes messages and buffers allocated once per device.
+
+I2C_RDWR = 0x0707
+I2C_M_RD = 0x0001
+
+# Errors that mean the handle itself is unusable (adapter gone, fd closed).
+# Anything else, such as a NACK (ENXIO, EREMOTEIO, EIO) from a device busy
+# converting, leaves the bus open for the next transaction.
+REOPEN_ERRNOS = {errno.EBADF, errno.ENODEV, errno.ENOENT, errno.ESHUTDOWN}
+
+class ChecksumError(OSError):
+    # A reply failed its CRC; the value is discarded rather than returned
+    pass
+
+def crc8_table(poly):
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ poly) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return table
+
+CRC8_31_TABLE = crc8_table(0x31)  # x^8 + x^5 + x^4 + 1 (Si70xx, Sensirion)
+
+def crc8(data, init=0x00, table=CRC8_31_TABLE):
+    crc = init
+    for byte in data:
+        crc = table[crc ^ byte]
+    return crc
+
+class I2cMsg(ctypes.Structure):
+    # struct i2c_msg from <linux/i2c.h>
+    _fields_ = [("addr", ctypes.c_uint16), ("flags", ctypes.c_uint16),
+                ("len", ctypes.c_uint16), ("buf", ctypes.POINTER(ctypes.c_uint8))]
+
+class I2cRdwrData(ctypes.Structure):
+    # struct i2c_rdwr_ioctl_data from <linux/i2c-dev.h>
+    _fields_ = [("msgs", ctypes.POINTER(I2cMsg)), ("nmsgs", ctypes.c_uint32)]
+
+class RdwrTransfer:
+    # Preallocated I2C_RDWR messages for one device address. The buffers are
+    # reused, so only call it inside a bus transaction.
+    def __init__(self, addr, max_write, max_read):
+        self.wbuf = (ctypes.c_uint8 * max_write)()
+        self.rbuf = (ctypes.c_uint8 * max_read)()
+        self.msgs = (I2cMsg * 2)()
+        self.msgs[0].addr = self.msgs[1].addr = addr
+        self.msgs[0].buf = ctypes.cast(self.wbuf, ctypes.POINTER(ctypes.c_uint8))
+        self.msgs[1].flags = I2C_M_RD
+        self.msgs[1].buf = ctypes.cast(self.rbuf, ctypes.POINTER(ctypes.c_uint8))
+        first = ctypes.cast(self.msgs, ctypes.POINTER(I2cMsg))
+        second = ctypes.cast(ctypes.byref(self.msgs, ctypes.sizeof(I2cMsg)), ctypes.POINTER(I2cMsg))
+        self.write_read_data = I2cRdwrData(first, 2)
+        self.write_data = I2cRdwrData(first, 1)
+        self.read_data = I2cRdwrData(second, 1)
+
+    def fill(self, data):
+        for i, byte in enumerate(data):
+            self.wbuf[i] = byte
+        self.msgs[0].len = len(data)
+
+    def write_read(self, bus, data, read_len):
+        # Write then read with a repeated start: one bus transaction
+        self.fill(data)
+        self.msgs[1].len = read_len
+        fcntl.ioctl(bus.fd, I2C_RDWR, ctypes.addressof(self.write_read_data))
+        return self.rbuf[:read_len]
+
+    def write(self, bus, data):
+        self.fill(data)
+        fcntl.ioctl(bus.fd, I2C_RDWR, ctypes.addressof(self.write_data))
+
+    def read(self, bus, read_len):
+        self.msgs[1].len = read_len
+        fcntl.ioctl(bus.fd, I2C_RDWR, ctypes.addressof(self.read_data))
+        return self.rbuf[:read_len]
+
+class I2CBusManager:
+    # The bus lock is re-entrant, so a sequence of commands can be wrapped in
+    # one outer transaction() and run as a single critical section.
+    def __init__(self):
+        self.buses = {}
+        self.devices = {}  # bus id -> set of registered addresses
+        self.locks = {}
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def bus_lock(self, bus_id):
+        with self.lock:
+            if bus_id not in self.locks:
+                self.locks[bus_id] = threading.RLock()
+                self.stats[bus_id] = {"transactions": 0, "errors": 0, "reopens": 0,
+                                      "wait_ms_max": 0.0, "wait_ms_total": 0.0}
+            return self.locks[bus_id]
+
+    def register(self, bus_id, addr):
+        with self.lock:
+            self.devices.setdefault(bus_id, set()).add(addr)
+
+    def unregister(self, bus_id, addr):
+        with self.lock:
+            self.devices.get(bus_id, set()).discard(addr)
+
+    def shared(self, bus_id):
+        return len(self.devices.get(bus_id, ())) > 1
+
+    def held(self):
+        # Bus id -> transaction nesting depth for the calling thread
+        if not hasattr(self.local, "held"):
+            self.local.held = {}
+        return self.local.held
+
+    @contextmanager
+    def transaction(self, bus_id):
+        lock = self.bus_lock(bus_id)
+        held = self.held()
+        depth = held.get(bus_id, 0)
+        t0 = time.monotonic()
+        with lock:
+            stats = self.stats[bus_id]
+            if not depth:
+                # Count acquisitions, not nested transactions inside one
+                waited = (time.monotonic() - t0) * 1000.0
+                stats["transactions"] += 1
+                stats["wait_ms_total"] += waited
+                stats["wait_ms_max"] = max(stats["wait_ms_max"], waited)
+            bus = self.buses.get(bus_id)
+            if bus is None:
+                bus = smbus2.SMBus(bus_id)
+                self.buses[bus_id] = bus
+            held[bus_id] = depth + 1
+            try:
+                yield bus
+            except OSError as e:
+                stats["errors"] += 1
+                if e.errno in REOPEN_ERRNOS:
+                    # Drop the handle so the next transaction reopens the adapter
+                    stats["reopens"] += 1
+                    self.buses.pop(bus_id, None)
+                    bus.close()
+                raise
+            finally:
+                held[bus_id] = depth
+
+    def conversion(self, bus_id, start, conversion_s, read, retries=5, retry_s=0.002):
+        # start(bus) triggers the measurement, read(bus) fetches the result;
+        # other devices get the bus for the whole conversion time
+        with self.transaction(bus_id) as bus:
+            start(bus)
+        time.sleep(conversion_s)
+        for attempt in range(retries):
+            try:
+                with self.transaction(bus_id) as bus:
+                    return read(bus)
+            except ChecksumError:
+                raise
+            except OSError as e:
+                # NACK: still converting
+                if e.errno in REOPEN_ERRNOS or attempt == retries - 1:
+                    raise
+                time.sleep(retry_s)
+
+    def get_stats(self):
+        with self.lock:
+            return {bus_id: dict(self.stats.get(bus_id, {}), devices=sorted(self.devices.get(bus_id, ())))
+                    for bus_id in set(self.stats) | set(self.devices)}
+
+bus_manager = I2CBusManager()
@@ -0,0 +1,88 @@
+import importlib.util
+import json
+import os
+import sys
+from flask import Flask, jsonify
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from werkzeug.serving import run_simple
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+from i2c_bus import bus_manager
+
+# One process for all the I2C sensor drivers on a gateway. Each driver
+# directory is loaded as a plugin and its unchanged Flask app is mounted at
+# /devices/<name>/..., so every device keeps its existing routes. All plugins
+# share i2c_bus.bus_manager, i.e. one handle and one lock per bus, instead of
+# each process opening /dev/i2c-N on its own. Every plugin registers its
+# address, so on a bus with several devices the drivers split conversions
+# (start, wait with the bus free, read) instead of clock-stretched reads,
+# e.g. Si7021 hold-mode requests run as no-hold measurements.
+#
+# GATEWAY_CONFIG names a JSON file {"<name>": {"module": "<driver dir>",
+# "env": {...}}, ...}. Drivers read their settings from the environment at
+# import, so "env" is applied while that plugin is imported (address, bus,
+# intervals). HISTORY_DIR defaults to GATEWAY_HISTORY_DIR/<name> so devices
+# never share a store; the default adafruit_mcp9808 entry clears it, since
+# that driver keeps no history unless asked to.
+GATEWAY_HOST = os.environ.get("GATEWAY_HOST", "0.0.0.0")
+GATEWAY_PORT = int(os.environ.get("GATEWAY_PORT", "8080"))
+GATEWAY_CONFIG = os.environ.get("GATEWAY_CONFIG")
+GATEWAY_HISTORY_DIR = os.environ.get("GATEWAY_HISTORY_DIR", "history")  # relative to this directory
+
+DEFAULT_DEVICES = {
+    "mcp9808": {"module": "mcp_9808_precision_i_2_c_temperature_sensor", "env": {"I2C_ADDRESS": "0x18"}},
+    "adafruit_mcp9808": {"module": "adafruit_mcp_9808_precision_i_2_c_temperature_sensor",
+                         "env": {"I2C_ADDRESS": "0x19", "HISTORY_DIR": ""}},
+    "si7021": {"module": "si_7021_a_20", "env": {}},
+}
+
+def load_config():
+    if not GATEWAY_CONFIG:
+        return DEFAULT_DEVICES
+    with open(GATEWAY_CONFIG) as f:
+        return json.load(f)
+
+def load_plugin(name, spec):
+    path = os.path.join(BASE_DIR, spec["module"], "driver.py")
+    env = {"HISTORY_DIR": os.path.join(BASE_DIR, GATEWAY_HISTORY_DIR, name)}
+    env.update({k: str(v) for k, v in spec.get("env", {}).items()})
+    saved = {k: os.environ.get(k) for k in env}
+    os.environ.update(env)
+    try:
+        module_spec = importlib.util.spec_from_file_location("devices." + name, path)
+        module = importlib.util.module_from_spec(module_spec)
+        module_spec.loader.exec_module(module)
+    finally:
+        for k, v in saved.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+    return module
+
+def create_gateway(devices):
+    plugins = {name: load_plugin(name, spec) for name, spec in devices.items()}
+    index = Flask(__name__)
+
+    @index.route('/')
+    @index.route('/devices')
+    def list_devices():
+        return jsonify({
+            "devices": {name: {"module": devices[name]["module"], "prefix": "/devices/" + name}
+                        for name in plugins},
+            "buses": bus_manager.get_stats(),
+        })
+
+    mounts = {"/devices/" + name: module.app for name, module in plugins.items()}
+    return plugins, DispatcherMiddleware(index, mounts)
+
+def start(plugins):
+    for module in plugins.values():
+        if hasattr(module, "start"):
+            module.start()
+
+if __name__ == '__main__':
+    plugins, application = create_gateway(load_config())
+    start(plugins)
+    run_simple(GATEWAY_HOST, GATEWAY_PORT, application, threaded=True)
@@ -0,0 +1,127 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+# Load test for the streaming drivers: holds N concurrent stream clients
+# against the Flask (wsgi) and ASGI serving modes and reports server RSS.
+# Usage: python loadtest_streaming.py camera|mic
+LOADTEST_HOST = os.environ.get('LOADTEST_HOST', '127.0.0.1')
+LOADTEST_PORT = int(os.environ.get('LOADTEST_PORT', 18080))
+LOADTEST_STEPS = [int(n) for n in os.environ.get('LOADTEST_STEPS', '0,50,100,200,400').split(',')]
+LOADTEST_MODES = os.environ.get('LOADTEST_MODES', 'wsgi,asgi').split(',')
+LOADTEST_SETTLE = float(os.environ.get('LOADTEST_SETTLE', 3))
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DRIVERS = {
+    # The camera runs against bench_fanout's synthetic source, so no RTSP server is needed
+    "camera": {
+        "dir": os.path.join(BASE_DIR, 'rtsp_camera'),
+        "setup": "import bench_fanout\n"
+                 "bench_fanout.BENCH_WIDTH, bench_fanout.BENCH_HEIGHT = 640, 480\n"
+                 "driver.cv2.VideoCapture = bench_fanout.SyntheticCapture\n",
+        "env": {"HTTP_SERVER_HOST": LOADTEST_HOST, "HTTP_SERVER_PORT": str(LOADTEST_PORT)},
+        "start": ("/stream/start", None),
+        "stream": "/stream/live",
+    },
+    "mic": {
+        "dir": os.path.join(BASE_DIR, 'wireless_microphone_system'),
+        "setup": "",
+        "env": {"SERVER_HOST": LOADTEST_HOST, "SERVER_PORT": str(LOADTEST_PORT)},
+        "start": ("/cmd/stream", {"action": "start"}),
+        "stream": "/data/audio",
+    },
+}
+
+SERVER_TEMPLATE = """
+import sys
+sys.path.insert(0, {dir!r})
+import driver
+{setup}
+if {mode!r} == 'asgi':
+    import asgi
+    import uvicorn
+    uvicorn.run(asgi.app, host={host!r}, port={port}, log_level='warning')
+else:
+    driver.app.run(host={host!r}, port={port}, threaded=True)
+"""
+
+def start_server(spec, mode):
+    code = SERVER_TEMPLATE.format(dir=spec["dir"], setup=spec["setup"], mode=mode,
+                                  host=LOADTEST_HOST, port=LOADTEST_PORT)
+    env = dict(os.environ, **spec["env"])
+    proc = subprocess.Popen([sys.executable, '-c', code], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    path, body = spec["start"]
+    data = json.dumps(body).encode() if body is not None else b''
+    t0 = time.time()
+    while time.time() - t0 < 30:
+        try:
+            req = urllib.request.Request(f"http://{LOADTEST_HOST}:{LOADTEST_PORT}{path}", data=data,
+                                         headers={"Content-Type": "application/json"}, method='POST')
+            urllib.request.urlopen(req, timeout=15).read()
+            return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError("server did not come up")
+
+def proc_status(pid):
+    fields = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            fields[key] = value.strip()
+    return int(fields["VmRSS"].split()[0]) / 1024.0, int(fields["Threads"])
+
+async def hold_stream(path, received):
+    reader, writer = await asyncio.open_connection(LOADTEST_HOST, LOADTEST_PORT)
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {LOADTEST_HOST}\r\n\r\n".encode())
+    await writer.drain()
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            received[0] += len(data)
+    finally:
+        writer.close()
+
+async def run_mode(spec, mode):
+    proc = start_server(spec, mode)
+    tasks = []
+    received = [0]
+    rows = []
+    try:
+        for target in LOADTEST_STEPS:
+            while len(tasks) < target:
+                tasks.append(asyncio.create_task(hold_stream(spec["stream"], received)))
+            await asyncio.sleep(LOADTEST_SETTLE)
+            alive = sum(1 for t in tasks if not t.done())
+            rss_mb, threads = proc_status(proc.pid)
+            rows.append((alive, rss_mb, threads))
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        proc.terminate()
+        proc.wait()
+    return rows
+
+def main():
+    name = sys.argv[1] if len(sys.argv) > 1 else 'camera'
+    spec = DRIVERS[name]
+    print(f"{'mode':>5} {'conns':>6} {'rss MB':>8} {'threads':>8} {'conns/MB':>9} {'MB/100 conns':>13}")
+    for mode in LOADTEST_MODES:
+        rows = asyncio.run(run_mode(spec, mode))
+        base_rss = rows[0][1]
+        for alive, rss_mb, threads in rows:
+            per_100 = (rss_mb - base_rss) / alive * 100 if alive else 0.0
+            print(f"{mode:>5} {alive:>6} {rss_mb:>8.1f} {threads:>8} {alive / rss_mb:>9.2f} {per_100:>13.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,18 @@
+import atexit
+import collections
 import os
+import re
+import sys
 import json
+import math
 import threading
 import time
 from flask import Flask, request, jsonify, Response
-import smbus2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from i2c_bus import bus_manager
+from sample_store import SampleStore
 
 # Environment variables for configuration
 I2C_BUS_ID = int(os.environ.get('I2C_BUS_ID', '1'))
@@ -11,6 +20,39 @@ I2C_ADDRESS = int(os.environ.get('I2C_ADDRESS', '0x18'), 16)
 HTTP_HOST = os.environ.get('HTTP_HOST', '0.0.0.0')
 HTTP_PORT = int(os.environ.get('HTTP_PORT', '8080'))
 SAMPLING_INTERVAL_MS = int(os.environ.get('SAMPLING_INTERVAL_MS', '1000'))
+RESOLUTION = int(os.environ.get('RESOLUTION', '3'))  # REG_RESOLUTION code, 3 = 0.0625 C
+POWER_MODE = os.environ.get('POWER_MODE', 'continuous')  # or 'shutdown' between samples
+# Alert limits in C (unset = disabled) and the hysteresis applied before a crossing clears
+ALERT_UPPER_C = os.environ.get('ALERT_UPPER_C')
+ALERT_LOWER_C = os.environ.get('ALERT_LOWER_C')
+ALERT_CRIT_C = os.environ.get('ALERT_CRIT_C')
+ALERT_HYSTERESIS_C = float(os.environ.get('ALERT_HYSTERESIS_C', '1.5'))
+ALERT_EVENT_DEPTH = int(os.environ.get('ALERT_EVENT_DEPTH', '256'))
+ALERT_KEEPALIVE_S = float(os.environ.get('ALERT_KEEPALIVE_S', '15'))
+MAX_LOG_LENGTH = int(os.environ.get('MAX_LOG_LENGTH', '864000'))  # 1 day at 10 Hz, ~8.6 MB
+MAX_HISTORY_BUCKETS = int(os.environ.get('MAX_HISTORY_BUCKETS', '10000'))
+MAX_LOG_PAGE = int(os.environ.get('MAX_LOG_PAGE', '10000'))  # larger ?limit= values are clamped
+# Log pages and history aggregations computed at once; the rest wait off the
+# GIL so the sampler keeps its cadence
+QUERY_CONCURRENCY = int(os.environ.get('QUERY_CONCURRENCY', '4'))
+
+# Rollup tiers kept alongside the raw log: (bucket width ms, buckets retained)
+ROLLUP_TIERS = [
+    (1000, 86400),       # 1 s for a day
+    (60000, 43200),      # 1 min for 30 days
+    (3600000, 8760),     # 1 h for a year
+]
+HISTORY_AGGS = ("min", "max", "mean", "count")
+
+# Durable history (see sample_store.py); a relative HISTORY_DIR is under this
+# driver's directory, an empty one keeps history in memory only
+HISTORY_DIR = os.environ.get('HISTORY_DIR', 'history')
+HISTORY_SEGMENT_MB = float(os.environ.get('HISTORY_SEGMENT_MB', '4'))
+HISTORY_RETENTION_MB = float(os.environ.get('HISTORY_RETENTION_MB', '256'))
+HISTORY_RETENTION_DAYS = float(os.environ.get('HISTORY_RETENTION_DAYS', '42'))
+HISTORY_FLUSH_S = float(os.environ.get('HISTORY_FLUSH_S', '5'))
+HISTORY_FSYNC_S = float(os.environ.get('HISTORY_FSYNC_S', '30'))
+HISTORY_LOAD_CHUNK_MS = 86400000  # rollups are reloaded a day at a time at startup
 
 # MCP9808 Register addresses
 REG_AMBIENT_TEMP = 0x05
@@ -24,102 +66,718 @@ REG_RESOLUTION = 0x08
 
 # Default Alert Output config (0x0000: all alert-disabled)
 DEFAULT_ALERT_CONFIG = 0x0000
+CONFIG_SHUTDOWN = 0x0100
+
+# REG_RESOLUTION code -> (C per LSB, max conversion time s) from the datasheet
+RESOLUTIONS = {
+    0: (0.5, 0.030),
+    1: (0.25, 0.065),
+    2: (0.125, 0.130),
+    3: (0.0625, 0.250),
+}
+POWER_MODES = ("continuous", "shutdown")
+LIMIT_REGISTERS = {"upper": REG_UPPER_TEMP, "lower": REG_LOWER_TEMP, "critical": REG_CRIT_TEMP}
+LIMIT_MIN_RAW, LIMIT_MAX_RAW = -4096, 4092  # -256 to +255.75 C in 1/16 C units
 
 # Global state
 sampling_interval_ms = SAMPLING_INTERVAL_MS
 current_i2c_address = I2C_ADDRESS
 alert_config = DEFAULT_ALERT_CONFIG
-temp_log = []
-temp_log_lock = threading.Lock()
-MAX_LOG_LENGTH = 1000
+resolution = RESOLUTION
+power_mode = POWER_MODE
+sampler_wakeup = threading.Event()  # set when scheduling settings change
+sampler_stats = {"reads": 0, "logged": 0, "duplicates": 0, "errors": 0}
+sample_times = collections.deque(maxlen=64)  # monotonic times of logged samples
+
+def ring_segments(count, capacity):
+    # Physical [lo, hi) ranges of a circular buffer in oldest-first order
+    if count <= capacity:
+        return [(0, count)]
+    first = count % capacity
+    return [(first, capacity), (0, first)]
+
+def ring_select(keys, arrays, segments, t_from, t_to):
+    # Copies of arrays where t_from <= keys < t_to, found by binary search per segment
+    parts = []
+    for lo, hi in segments:
+        a = lo + int(np.searchsorted(keys[lo:hi], t_from, 'left'))
+        b = lo + int(np.searchsorted(keys[lo:hi], t_to, 'left'))
+        if b > a:
+            parts.append((a, b))
+    if len(parts) == 1:
+        a, b = parts[0]
+        return [arr[a:b].copy() for arr in arrays]
+    return [np.concatenate([arr[a:b] for a, b in parts]) if parts else arr[:0].copy() for arr in arrays]
+
+class TempLog:
+    # Fixed-capacity circular buffer of int64 ms timestamps and int16 raw
+    # 13-bit readings (1/16 C per LSB), 10 bytes per sample with O(1) append.
+    # Logical index 0 is the oldest retained sample.
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.timestamps = np.zeros(capacity, dtype=np.int64)
+        self.raw = np.zeros(capacity, dtype=np.int16)
+        self.count = 0  # total samples ever appended
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def append(self, timestamp_ms, raw):
+        i = self.count % self.capacity
+        self.timestamps[i] = timestamp_ms
+        self.raw[i] = raw
+        self.count += 1
+
+    def latest(self):
+        i = (self.count - 1) % self.capacity
+        return int(self.timestamps[i]), int(self.raw[i])
+
+    def slice_at(self, count, start, stop):
+        # Copies of the logical range [start, stop) as it was when `count` samples
+        # had been appended, taken without the lock. The writer only ever advances,
+        # so the copy is valid unless it reached a slot overwritten meanwhile;
+        # returns None in that case.
+        lo = max(0, count - self.capacity) + start
+        first = lo % self.capacity
+        if first + stop - start <= self.capacity:
+            timestamps = self.timestamps[first:first + stop - start].copy()
+            raw = self.raw[first:first + stop - start].copy()
+        else:
+            idx = np.arange(first, first + stop - start) % self.capacity
+            timestamps, raw = self.timestamps[idx], self.raw[idx]
+        if self.count >= lo + self.capacity:
+            return None
+        return timestamps, raw
+
+    def select(self, t_from, t_to):
+        # Samples with t_from <= timestamp < t_to as (timestamps, raw)
+        segments = ring_segments(self.count, self.capacity)
+        return ring_select(self.timestamps, [self.timestamps, self.raw], segments, t_from, t_to)
+
+    def oldest(self):
+        return int(self.timestamps[ring_segments(self.count, self.capacity)[0][0]]) if self.count else None
+
+    def load(self, timestamps, raw):
+        # Bulk fill of an empty log, keeping the newest `capacity` samples
+        n = min(len(timestamps), self.capacity)
+        self.timestamps[:n] = timestamps[len(timestamps) - n:]
+        self.raw[:n] = raw[len(raw) - n:]
+        self.count = n
+
+class Rollup:
+    # Pre-aggregated tier: per fixed-width bucket the count, sum, min and max of
+    # raw readings, kept in a ring and updated in O(1) as each sample arrives
+    def __init__(self, width_ms, capacity):
+        self.width_ms = width_ms
+        self.capacity = capacity
+        self.starts = np.zeros(capacity, dtype=np.int64)
+        self.counts = np.zeros(capacity, dtype=np.int64)
+        self.sums = np.zeros(capacity, dtype=np.int64)
+        self.mins = np.zeros(capacity, dtype=np.int16)
+        self.maxs = np.zeros(capacity, dtype=np.int16)
+        self.count = 0  # buckets ever opened
+
+    def add(self, timestamp_ms, raw):
+        start = timestamp_ms - timestamp_ms % self.width_ms
+        i = (self.count - 1) % self.capacity
+        # Samples that land before the open bucket (clock stepped back) are folded into it
+        if self.count and start <= self.starts[i]:
+            self.counts[i] += 1
+            self.sums[i] += raw
+            if raw < self.mins[i]:
+                self.mins[i] = raw
+            if raw > self.maxs[i]:
+                self.maxs[i] = raw
+            return
+        i = self.count % self.capacity
+        self.starts[i] = start
+        self.counts[i] = 1
+        self.sums[i] = raw
+        self.mins[i] = raw
+        self.maxs[i] = raw
+        self.count += 1
+
+    def extend(self, timestamps, raw):
+        # Bulk append of time-ordered samples that start a new bucket, i.e.
+        # loaded in chunks aligned to width_ms
+        if not len(timestamps):
+            return
+        keys = timestamps // self.width_ms
+        idx = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+        counts = np.diff(np.append(idx, len(raw)))
+        sums = np.add.reduceat(raw.astype(np.int64), idx)
+        mins = np.minimum.reduceat(raw, idx)
+        maxs = np.maximum.reduceat(raw, idx)
+        keep = slice(max(0, len(idx) - self.capacity), None)
+        n = len(idx[keep])
+        pos = (self.count + np.arange(len(idx) - n, len(idx))) % self.capacity
+        self.starts[pos] = keys[idx[keep]] * self.width_ms
+        self.counts[pos] = counts[keep]
+        self.sums[pos] = sums[keep]
+        self.mins[pos] = mins[keep]
+        self.maxs[pos] = maxs[keep]
+        self.count += len(idx)
+
+    def select(self, t_from, t_to):
+        # Buckets starting in [t_from, t_to) as (starts, counts, sums, mins, maxs)
+        segments = ring_segments(self.count, self.capacity)
+        return ring_select(self.starts, [self.starts, self.counts, self.sums, self.mins, self.maxs],
+                           segments, t_from, t_to)
+
+class AlertMonitor:
+    # Evaluates every logged sample against the limits (raw 1/16 C units) and
+    # publishes crossings as numbered events. SSE subscribers block on the
+    # condition between events, so an idle subscriber costs no bus or CPU time.
+    #   upper:    set when T > upper,     clears when T <= upper - hysteresis
+    #   lower:    set when T < lower,     clears when T >= lower + hysteresis
+    #   critical: set when T >= critical, clears when T < critical - hysteresis
+    def __init__(self, limits, hysteresis, depth):
+        self.cond = threading.Condition()
+        self.limits = limits
+        self.hysteresis = hysteresis
+        self.active = set()
+        self.events = collections.deque(maxlen=depth)
+        self.seq = 0
+        self.last_sample = None
+
+    def crossed(self, name, limit, raw):
+        hyst = self.hysteresis
+        if name in self.active:
+            if name == "upper":
+                return raw > limit - hyst
+            if name == "lower":
+                return raw < limit + hyst
+            return raw >= limit - hyst
+        if name == "upper":
+            return raw > limit
+        if name == "lower":
+            return raw < limit
+        return raw >= limit
+
+    def evaluate(self, ts, raw):
+        with self.cond:
+            self.last_sample = (ts, raw)
+            for name, limit in self.limits.items():
+                now_active = limit is not None and self.crossed(name, limit, raw)
+                if now_active != (name in self.active):
+                    if now_active:
+                        self.active.add(name)
+                    else:
+                        self.active.discard(name)
+                    self.publish({
+                        "limit": name,
+                        "state": "set" if now_active else "clear",
+                        "temp": raw_to_celsius(raw),
+                        "threshold": None if limit is None else limit / 16.0,
+                        "timestamp": ts,
+                    })
+
+    def publish(self, event):
+        # Caller holds self.cond
+        self.seq += 1
+        event["seq"] = self.seq
+        self.events.append((self.seq, event))
+        self.cond.notify_all()
+
+    def set_limits(self, limits, hysteresis):
+        # Re-evaluates the last sample so changed limits take effect immediately
+        with self.cond:
+            self.limits = limits
+            self.hysteresis = hysteresis
+            if self.last_sample is not None:
+                self.evaluate(*self.last_sample)
+
+    def wait(self, last_seq, timeout):
+        # Events newer than last_seq, waiting up to timeout for the first one
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > last_seq, timeout)
+            return [item for item in self.events if item[0] > last_seq]
+
+    def status(self):
+        with self.cond:
+            return {
+                "active": sorted(self.active),
+                "limits": {k: None if v is None else v / 16.0 for k, v in self.limits.items()},
+                "hysteresis": self.hysteresis / 16.0,
+                "seq": self.seq,
+                "last_sample": None if self.last_sample is None else {
+                    "timestamp": self.last_sample[0], "temp": raw_to_celsius(self.last_sample[1])},
+            }
+
+def limit_to_raw(celsius):
+    # Limit registers hold 0.25 C steps; keep the monitor at the same precision.
+    # Anything the 13-bit register cannot hold is rejected rather than wrapped.
+    if celsius is None:
+        return None
+    celsius = float(celsius)
+    if not math.isfinite(celsius):
+        raise ValueError(f"limit must be a finite temperature, got {celsius}")
+    raw = int(round(celsius * 4)) * 4
+    if not LIMIT_MIN_RAW <= raw <= LIMIT_MAX_RAW:
+        raise ValueError(f"limit {celsius} C is outside {LIMIT_MIN_RAW / 16.0} to {LIMIT_MAX_RAW / 16.0} C")
+    return raw
+
+temp_log = TempLog(MAX_LOG_LENGTH)
+rollups = [Rollup(width_ms, capacity) for width_ms, capacity in ROLLUP_TIERS]
+temp_log_lock = threading.Lock()  # serializes writers and history queries
+alert_monitor = AlertMonitor(
+    {"upper": limit_to_raw(ALERT_UPPER_C), "lower": limit_to_raw(ALERT_LOWER_C),
+     "critical": limit_to_raw(ALERT_CRIT_C)},
+    int(round(ALERT_HYSTERESIS_C * 16)),
+    ALERT_EVENT_DEPTH,
+)
+history_store = None
+
+# Latest reading as (samples logged, timestamp ms, raw). The writer replaces the
+# whole tuple after each append, so /temp reads it without taking temp_log_lock.
+temp_snapshot = (0, None, None)
 
 app = Flask(__name__)
+bus_manager.register(I2C_BUS_ID, I2C_ADDRESS)
+
+class QuerySlots:
+    # Counting semaphore that hands a freed slot straight to the longest
+    # waiter. threading.Semaphore lets the releasing thread take the slot
+    # straight back before a woken waiter gets the GIL, which left some
+    # requests queued for hundreds of ms.
+    def __init__(self, slots):
+        self.free = slots
+        self.lock = threading.Lock()
+        self.waiters = collections.deque()
+
+    def acquire(self):
+        with self.lock:
+            if self.free and not self.waiters:
+                self.free -= 1
+                return
+            waiter = threading.Lock()
+            waiter.acquire()
+            self.waiters.append(waiter)
+        waiter.acquire()  # released by the thread that hands over its slot
+
+    def release(self):
+        with self.lock:
+            if self.waiters:
+                self.waiters.popleft().release()
+            else:
+                self.free += 1
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+# Every runnable thread competes for the GIL, and a thread coming back from
+# a sleep or bus I/O waits for a switch interval per competitor. With dozens
+# of threads serializing log pages or aggregating history the sampler lost
+# most of its slots that way, so only QUERY_CONCURRENCY of those run at once
+# and the others block on a lock, which costs no GIL. Slots are taken after
+# the request is parsed and only around that work; cheap routes never wait.
+query_slots = QuerySlots(QUERY_CONCURRENCY)
 
 def read_word(bus, addr, reg):
     # Read a 16-bit word and swap bytes
     raw = bus.read_word_data(addr, reg)
     return ((raw << 8) & 0xFF00) | (raw >> 8)
 
+def read_temperature_raw(bus, addr):
+    # Returns the signed 13-bit ambient reading in 1/16 C steps
+    raw = read_word(bus, addr, REG_AMBIENT_TEMP)
+    value = raw & 0x0FFF
+    if raw & 0x1000:
+        value -= 4096
+    return value
+
+def raw_to_celsius(value):
+    return round(value / 16.0, 4)
+
 def read_temperature(bus, addr):
     # Returns temperature in Celsius
-    raw = read_word(bus, addr, REG_AMBIENT_TEMP)
-    temp = raw & 0x0FFF
-    temp /= 16.0
+    return raw_to_celsius(read_temperature_raw(bus, addr))
+
+def read_limit(bus, addr, reg):
+    # Inverse of write_limit, in raw 1/16 C units
+    raw = read_word(bus, addr, reg)
+    value = raw & 0x0FFC
     if raw & 0x1000:
-        temp -= 256.0
-    return round(temp, 4)
-
-def read_alert_status(bus, addr):
-    conf = read_word(bus, addr, REG_CONFIG)
-    # Bits 2:0 of config register encode alert output status
-    alert_output = bool(conf & 0x0008)
-    return {
-        "alert_output": alert_output,
-        "config_register": conf
-    }
+        value -= 4096
+    return value
 
 def write_config(bus, addr, config):
     # Write 16-bit config
     val = ((config & 0xFF) << 8) | ((config >> 8) & 0xFF)
     bus.write_word_data(addr, REG_CONFIG, val)
 
+def config_word(alert_cfg, shutdown):
+    return (alert_cfg & ~CONFIG_SHUTDOWN) | (CONFIG_SHUTDOWN if shutdown else 0)
+
 def set_alert_config(bus, addr, alert_cfg):
-    # Set config register
-    write_config(bus, addr, alert_cfg)
+    # Set config register, keeping the sensor asleep in shutdown mode
+    write_config(bus, addr, config_word(alert_cfg, power_mode == "shutdown"))
+
+def write_limit(bus, addr, reg, raw):
+    # Limit registers: 0.25 C steps in bits 12:2, two's complement, MSB first
+    val = raw & 0x1FFC
+    bus.write_word_data(addr, reg, ((val & 0xFF) << 8) | (val >> 8))
+
+def write_limits(bus, addr, limits):
+    for name, raw in limits.items():
+        if raw is not None:
+            write_limit(bus, addr, LIMIT_REGISTERS[name], raw)
+
+def write_resolution(bus, addr, code):
+    bus.write_byte_data(addr, REG_RESOLUTION, code)
+
+def parse_resolution(value):
+    # Accepts a register code (0-3) or a step in C (0.5, 0.25, 0.125, 0.0625)
+    for code, (step, _) in RESOLUTIONS.items():
+        if value == code or value == step:
+            return code
+    raise ValueError("resolution must be a code 0-3 or one of 0.5, 0.25, 0.125, 0.0625")
+
+def conversion_time_s():
+    return RESOLUTIONS[resolution][1]
+
+def sample_period_s():
+    # Whole number of conversions per sample, so every read sees a new result
+    conversion = conversion_time_s()
+    conversions = max(1, -(-sampling_interval_ms // int(conversion * 1000)))
+    return conversions * conversion
 
 def set_sampling_interval(interval_ms):
     global sampling_interval_ms
     sampling_interval_ms = max(100, int(interval_ms))
+    sampler_wakeup.set()
+
+def effective_sample_rate():
+    times = list(sample_times)
+    if len(times) < 2 or times[-1] == times[0]:
+        return None
+    return round((len(times) - 1) / (times[-1] - times[0]), 3)
+
+def get_sampling_status():
+    step, conversion = RESOLUTIONS[resolution]
+    return dict(
+        sampler_stats,
+        interval_ms=sampling_interval_ms,
+        period_ms=round(sample_period_s() * 1000, 1),
+        resolution=resolution,
+        resolution_c=step,
+        conversion_ms=conversion * 1000,
+        power_mode=power_mode,
+        effective_hz=effective_sample_rate(),
+    )
 
 def set_i2c_address(new_addr):
     global current_i2c_address
+    bus_manager.unregister(I2C_BUS_ID, current_i2c_address)
+    bus_manager.register(I2C_BUS_ID, new_addr)
     current_i2c_address = new_addr
 
-def log_temperature_reading(temp):
+def log_temperature_reading(raw):
+    global temp_snapshot
     with temp_log_lock:
         ts = int(time.time() * 1000)
-        temp_log.append({"timestamp": ts, "temp": temp})
-        if len(temp_log) > MAX_LOG_LENGTH:
-            temp_log.pop(0)
+        temp_log.append(ts, raw)
+        temp_snapshot = (temp_log.count, ts, raw)
+        for rollup in rollups:
+            rollup.add(ts, raw)
+        if history_store is not None:
+            history_store.append(ts, raw)
+    alert_monitor.evaluate(ts, raw)
+
+def open_history():
+    # Opens the on-disk store and reloads the in-memory log and rollups from it
+    global history_store
+    if not HISTORY_DIR:
+        return
+    store = SampleStore(
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), HISTORY_DIR),
+        segment_bytes=int(HISTORY_SEGMENT_MB * (1 << 20)),
+        retention_bytes=int(HISTORY_RETENTION_MB * (1 << 20)),
+        retention_seconds=HISTORY_RETENTION_DAYS * 86400,
+        flush_interval_s=HISTORY_FLUSH_S,
+        fsync_interval_s=HISTORY_FSYNC_S,
+    )
+    global temp_snapshot
+    with temp_log_lock:
+        load_history(store)
+        if temp_log.count:
+            temp_snapshot = (temp_log.count,) + temp_log.latest()
+        history_store = store
+    atexit.register(store.close)
+
+def load_history(store):
+    # Reads only what each in-memory structure can hold: the log's capacity
+    # at the current sample period, and each rollup tier's own span in
+    # bucket-aligned chunks, so startup memory does not grow with retention.
+    # Caller holds temp_log_lock.
+    now = int(time.time() * 1000)
+    timestamps, raw = store.query(now - int(temp_log.capacity * sample_period_s() * 1000), 1 << 62)
+    temp_log.load(timestamps, raw)
+    for rollup in rollups:
+        chunk = max(1, HISTORY_LOAD_CHUNK_MS // rollup.width_ms) * rollup.width_ms
+        t = now - rollup.capacity * rollup.width_ms
+        t -= t % rollup.width_ms
+        while t <= now:
+            # The last chunk is open-ended in case stored timestamps run ahead of the clock
+            t_to = t + chunk if t + chunk <= now else 1 << 62
+            rollup.extend(*store.query(t, t_to))
+            t += chunk
+
+def parse_duration_ms(value):
+    m = re.fullmatch(r'(\d+)(ms|s|m|h|d)?', value.strip())
+    if not m:
+        raise ValueError(f"invalid duration '{value}'")
+    scale = {"ms": 1, "s": 1000, "m": 60000, "h": 3600000, "d": 86400000}[m.group(2) or "s"]
+    return int(m.group(1)) * scale
+
+def history_source(bucket_ms, t_from):
+    # Coarsest rollup tier that divides the bucket width and still covers t_from;
+    # otherwise the raw samples. Caller holds temp_log_lock.
+    for rollup in reversed(rollups):
+        if bucket_ms % rollup.width_ms or not rollup.count:
+            continue
+        oldest = ring_segments(rollup.count, rollup.capacity)[0][0]
+        if rollup.starts[oldest] <= t_from or rollup.count <= rollup.capacity:
+            return rollup
+    return temp_log
+
+def aggregate_history(t_from, t_to, bucket_ms):
+    # Returns (source name, bucket starts, counts, sums, mins, maxs) for [t_from, t_to)
+    t_from -= t_from % bucket_ms
+    with temp_log_lock:
+        source = history_source(bucket_ms, t_from)
+        if source is temp_log and history_store is not None and (
+                not temp_log.count or t_from < temp_log.oldest()):
+            source = history_store
+        if source is temp_log:
+            timestamps, raw = temp_log.select(t_from, t_to)
+        elif source is not history_store:
+            timestamps, counts, sums, mins, maxs = source.select(t_from, t_to)
+    if source is history_store:
+        # Older than the in-memory log: read the range from disk (the store has its own lock)
+        timestamps, raw = history_store.query(t_from, t_to)
+    if source is temp_log or source is history_store:
+        name = "raw" if source is temp_log else "disk"
+        counts = np.ones(len(raw), dtype=np.int64)
+        sums = raw.astype(np.int64)
+        mins = maxs = raw
+    else:
+        name = f"{source.width_ms // 1000}s"
+    if not len(timestamps):
+        empty = np.zeros(0, dtype=np.int64)
+        return name, empty, empty, empty, empty, empty
+    keys = timestamps // bucket_ms
+    # Input is time-ordered, so each bucket is one contiguous run
+    idx = np.concatenate(([0], np.flatnonzero(np.diff(keys)) + 1))
+    return (name, keys[idx] * bucket_ms, np.add.reduceat(counts, idx), np.add.reduceat(sums, idx),
+            np.minimum.reduceat(mins, idx), np.maximum.reduceat(maxs, idx))
+
+def log_rows_json(timestamps, raw):
+    # Serialize log rows straight from the arrays, without building a dict per row
+    temps = (raw / 16.0).tolist()
+    return '[' + ','.join(
+        '{"timestamp":%d,"temp":%r}' % row for row in zip(timestamps.tolist(), temps)
+    ) + ']'
+
+def read_sample(addr, settle_s):
+    # In shutdown mode wake the sensor for one conversion and put it back to
+    # sleep; the bus stays free for other devices during the conversion
+    if power_mode != "shutdown":
+        with bus_manager.transaction(I2C_BUS_ID) as bus:
+            return read_temperature_raw(bus, addr)
+    try:
+        return bus_manager.conversion(I2C_BUS_ID, lambda bus: write_config(bus, addr, config_word(alert_config, False)),
+                                      settle_s, lambda bus: read_temperature_raw(bus, addr), retries=1)
+    finally:
+        with bus_manager.transaction(I2C_BUS_ID) as bus:
+            write_config(bus, addr, config_word(alert_config, True))
 
 def temp_sampling_loop():
-    bus = smbus2.SMBus(I2C_BUS_ID)
+    # Reads on conversion boundaries: deadlines advance by a whole number of
+    # conversion times from the moment the resolution and power mode were
+    # applied. The datasheet times are maxima, so each slot sees a fresh
+    # result. A read that starts in the same conversion slot the previous
+    # read finished in (a read that overran its slot, a wakeup right after a
+    # read) can only repeat that result and is dropped as a duplicate.
+    applied = None
+    anchor = time.monotonic()  # conversions (re)started here under the current settings
+    last_read = None
+    last_slot = None  # conversion slot the previous read finished in
+    next_read = time.monotonic()
+
+    def conversion_slot(t):
+        # Index of the conversion period containing t; the epsilon keeps a
+        # deadline exactly on a boundary in the slot it opens
+        return int((t - anchor) / conversion_time_s() + 1e-6)
+
     while True:
+        settings = (current_i2c_address, resolution, power_mode)
+        if settings != applied:
+            try:
+                with bus_manager.transaction(I2C_BUS_ID) as bus:
+                    write_resolution(bus, current_i2c_address, resolution)
+                    write_limits(bus, current_i2c_address, alert_monitor.limits)
+                    write_config(bus, current_i2c_address, config_word(alert_config, power_mode == "shutdown"))
+                applied = settings
+            except Exception:
+                sampler_stats["errors"] += 1
+            # A new conversion starts now; the first result is ready one conversion later
+            anchor = time.monotonic()
+            next_read = anchor + conversion_time_s()
+            last_read = None
+            last_slot = None
+        delay = next_read - time.monotonic()
+        if delay > 0 and sampler_wakeup.wait(delay):
+            # Settings changed: pick up a new interval from the next fresh result
+            sampler_wakeup.clear()
+            if last_read is not None:
+                next_read = last_read + conversion_time_s()
+            continue
         try:
-            temp = read_temperature(bus, current_i2c_address)
-            log_temperature_reading(temp)
+            started = time.monotonic()
+            raw = read_sample(current_i2c_address, conversion_time_s())
+            sampler_stats["reads"] += 1
+            # In shutdown mode every read triggers its own conversion
+            stale = power_mode != "shutdown" and last_slot is not None and conversion_slot(started) <= last_slot
+            last_slot = conversion_slot(time.monotonic())
+            if stale:
+                sampler_stats["duplicates"] += 1
+            else:
+                last_read = next_read
+                log_temperature_reading(raw)
+                sample_times.append(time.monotonic())
+                sampler_stats["logged"] += 1
         except Exception:
-            pass
-        time.sleep(sampling_interval_ms / 1000.0)
+            sampler_stats["errors"] += 1
+        period = sample_period_s()
+        next_read += period
+        now = time.monotonic()
+        if next_read < now:
+            # Fell behind (slow bus, stall): skip missed slots but stay on the conversion grid
+            next_read += -(-(now - next_read) // period) * period
+
+def read_log_page(count, start, limit):
+    # Lock-free page of the log as of `count` samples (same slice semantics as
+    # the old list); if the sampler lapped the copy, retry under the lock
+    # against the current log
+    lo, hi, _ = slice(start, start + limit).indices(min(count, temp_log.capacity))
+    page = temp_log.slice_at(count, lo, max(lo, hi))
+    if page is None:
+        with temp_log_lock:
+            page = temp_log.slice_at(temp_log.count, lo, max(lo, hi))
+    return page
 
 @app.route('/temp', methods=['GET'])
 def get_temp():
-    with temp_log_lock:
-        if not temp_log:
-            try:
-                with smbus2.SMBus(I2C_BUS_ID) as bus:
-                    temp = read_temperature(bus, current_i2c_address)
-            except Exception as e:
-                return jsonify({"error": str(e)}), 500
-            log_temperature_reading(temp)
-            resp = {"temp": temp, "unit": "C"}
-        else:
-            resp = {"temp": temp_log[-1]['temp'], "unit": "C"}
-        # Support pagination
-        start = int(request.args.get('start', '0'))
-        limit = int(request.args.get('limit', '1'))
-        if request.args.get('log') == '1' or limit > 1:
-            resp['log'] = temp_log[start:start+limit]
-    return jsonify(resp)
+    count, _, raw = temp_snapshot
+    if not count:
+        # Nothing sampled yet: read directly, outside any lock
+        try:
+            with bus_manager.transaction(I2C_BUS_ID) as bus:
+                raw = read_temperature_raw(bus, current_i2c_address)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        log_temperature_reading(raw)
+        count = temp_snapshot[0]
+    resp = {"temp": raw_to_celsius(raw), "unit": "C"}
+    # Support pagination
+    start = int(request.args.get('start', '0'))
+    limit = min(int(request.args.get('limit', '1')), MAX_LOG_PAGE)
+    if request.args.get('log') != '1' and limit <= 1:
+        return jsonify(resp)
+    with query_slots:
+        page = read_log_page(count, start, limit)
+        body = json.dumps(resp)
+        body = body[:-1] + ', "log": ' + log_rows_json(*page) + '}'
+    return Response(body, mimetype='application/json')
+
+@app.route('/temp/history', methods=['GET'])
+def get_temp_history():
+    try:
+        t_to = int(request.args.get('to', int(time.time() * 1000)))
+        t_from = int(request.args.get('from', t_to - 3600000))
+        bucket_ms = parse_duration_ms(request.args.get('bucket', '60s'))
+        aggs = [a for a in request.args.get('agg', 'min,max,mean').split(',') if a]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if bucket_ms <= 0 or t_to <= t_from:
+        return jsonify({"error": "'bucket' must be positive and 'from' before 'to'"}), 400
+    if any(a not in HISTORY_AGGS for a in aggs):
+        return jsonify({"error": "'agg' must be a list of " + ",".join(HISTORY_AGGS)}), 400
+    if (t_to - t_from) // bucket_ms > MAX_HISTORY_BUCKETS:
+        return jsonify({"error": f"more than {MAX_HISTORY_BUCKETS} buckets requested"}), 400
+    with query_slots:
+        source, starts, counts, sums, mins, maxs = aggregate_history(t_from, t_to, bucket_ms)
+        resp = {"from": t_from, "to": t_to, "bucket_ms": bucket_ms, "source": source, "unit": "C",
+                "start": starts.tolist()}
+        if "min" in aggs:
+            resp["min"] = (mins / 16.0).tolist()
+        if "max" in aggs:
+            resp["max"] = (maxs / 16.0).tolist()
+        if "mean" in aggs:
+            resp["mean"] = np.round(sums / counts / 16.0, 4).tolist() if len(counts) else []
+        if "count" in aggs:
+            resp["count"] = counts.tolist()
+        return jsonify(resp)
 
 @app.route('/alert', methods=['GET'])
 def get_alert():
+    # Served from the sampler's evaluation; subscribe to /alert/events instead of polling
+    return jsonify(alert_status())
+
+def alert_events(last_seq):
+    # Current state first, then every crossing as it happens
+    yield "event: status\ndata: %s\n\n" % json.dumps(alert_monitor.status())
+    while True:
+        events = alert_monitor.wait(last_seq, ALERT_KEEPALIVE_S)
+        if not events:
+            yield ": keepalive\n\n"
+            continue
+        for seq, event in events:
+            yield "id: %d\nevent: alert\ndata: %s\n\n" % (seq, json.dumps(event))
+        last_seq = events[-1][0]
+
+@app.route('/alert/events', methods=['GET'])
+def get_alert_events():
+    # Server-Sent Events; reconnecting clients resume after Last-Event-ID while
+    # the events are still in the ring
+    try:
+        last_seq = int(request.headers.get('Last-Event-ID', alert_monitor.seq))
+    except ValueError:
+        last_seq = alert_monitor.seq
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(alert_events(last_seq), mimetype='text/event-stream', headers=headers)
+
+@app.route('/limits', methods=['GET'])
+def get_limits():
+    return jsonify(alert_monitor.status())
+
+@app.route('/limits', methods=['PUT'])
+def put_limits():
+    data = request.get_json(force=True)
+    if not isinstance(data, dict) or not set(data) & (set(LIMIT_REGISTERS) | {"hysteresis"}):
+        return jsonify({"error": "JSON body must have any of 'upper', 'lower', 'critical' (C, null to disable) or 'hysteresis' (C)"}), 400
+    limits = dict(alert_monitor.limits)
+    try:
+        for name in LIMIT_REGISTERS:
+            if name in data:
+                limits[name] = limit_to_raw(data[name])
+        hysteresis = float(data.get("hysteresis", alert_monitor.hysteresis / 16.0))
+        if not math.isfinite(hysteresis) or hysteresis < 0:
+            raise ValueError("'hysteresis' must be a finite, non-negative temperature")
+        hysteresis = int(round(hysteresis * 16))
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
     try:
-        with smbus2.SMBus(I2C_BUS_ID) as bus:
-            status = read_alert_status(bus, current_i2c_address)
+        with bus_manager.transaction(I2C_BUS_ID) as bus:
+            write_limits(bus, current_i2c_address, limits)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
-    return jsonify(status)
+    alert_monitor.set_limits(limits, hysteresis)
+    return jsonify(dict(alert_monitor.status(), result="ok"))
 
 @app.route('/alertcfg', methods=['PUT'])
 def put_alertcfg():
@@ -128,7 +786,7 @@ def put_alertcfg():
         return jsonify({"error": "JSON body must have 'config' field (16-bit int)"}), 400
     alert_cfg = int(data["config"])
     try:
-        with smbus2.SMBus(I2C_BUS_ID) as bus:
+        with bus_manager.transaction(I2C_BUS_ID) as bus:
             set_alert_config(bus, current_i2c_address, alert_cfg)
         global alert_config
         alert_config = alert_cfg
@@ -146,7 +804,109 @@ def put_interval():
         set_sampling_interval(interval)
     except Exception as e:
         return jsonify({"error": str(e)}), 400
-    return jsonify({"result": "ok", "interval": sampling_interval_ms})
+    return jsonify({"result": "ok", "interval": sampling_interval_ms,
+                    "period_ms": round(sample_period_s() * 1000, 1)})
+
+@app.route('/resolution', methods=['PUT'])
+def put_resolution():
+    global resolution
+    data = request.get_json(force=True)
+    if not isinstance(data, dict) or "resolution" not in data:
+        return jsonify({"error": "JSON body must have 'resolution' field (code 0-3 or step in C)"}), 400
+    try:
+        code = parse_resolution(data["resolution"])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        with bus_manager.transaction(I2C_BUS_ID) as bus:
+            write_resolution(bus, current_i2c_address, code)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    resolution = code
+    sampler_wakeup.set()
+    return jsonify({"result": "ok", "resolution": code, "resolution_c": RESOLUTIONS[code][0]})
+
+@app.route('/power', methods=['PUT'])
+def put_power():
+    global power_mode
+    data = request.get_json(force=True)
+    if not isinstance(data, dict) or data.get("mode") not in POWER_MODES:
+        return jsonify({"error": "JSON body must have 'mode' field ('continuous' or 'shutdown')"}), 400
+    power_mode = data["mode"]
+    sampler_wakeup.set()
+    return jsonify({"result": "ok", "mode": power_mode})
+
+@app.route('/sampling', methods=['GET'])
+def get_sampling():
+    return jsonify(get_sampling_status())
+
+def alert_status():
+    status = alert_monitor.status()
+    status["alert_output"] = bool(status["active"])
+    status["config_register"] = alert_config
+    return status
+
+# POST /batch operations, named after the routes they stand in for. The
+# cached ones never touch the bus; the register reads share one acquisition.
+BATCH_CACHED_OPS = {
+    "alert": alert_status,
+    "limits": alert_monitor.status,
+    "sampling": get_sampling_status,
+}
+BATCH_REGISTER_OPS = {
+    "register/config": lambda bus, addr: {"config_register": read_word(bus, addr, REG_CONFIG)},
+    "register/resolution": lambda bus, addr: resolution_result(bus.read_byte_data(addr, REG_RESOLUTION) & 0x03),
+    "register/limits": lambda bus, addr: {
+        name: read_limit(bus, addr, reg) / 16.0 for name, reg in LIMIT_REGISTERS.items()},
+    "info/id": lambda bus, addr: id_result(read_word(bus, addr, REG_MANUF_ID), read_word(bus, addr, REG_DEVICE_ID)),
+}
+
+def resolution_result(code):
+    return {"resolution": code, "resolution_c": RESOLUTIONS[code][0]}
+
+def id_result(manufacturer, device):
+    return {"manufacturer_id": "0x%04X" % manufacturer, "device_id": "0x%02X" % (device >> 8),
+            "revision": device & 0xFF}
+
+def run_batch(ops):
+    # The sampler's snapshot serves "temp" unless nothing has been sampled
+    # yet; that read and every register read run under one bus acquisition
+    results = {}
+    raw = None
+    with bus_manager.transaction(I2C_BUS_ID) as bus:
+        addr = current_i2c_address
+        for op in ops:
+            if op in results:
+                continue
+            try:
+                if op == "temp":
+                    count, _, raw = temp_snapshot
+                    if not count:
+                        raw = read_temperature_raw(bus, addr)
+                    results[op] = {"temp": raw_to_celsius(raw), "unit": "C"}
+                elif op in BATCH_CACHED_OPS:
+                    results[op] = BATCH_CACHED_OPS[op]()
+                else:
+                    results[op] = BATCH_REGISTER_OPS[op](bus, addr)
+            except OSError as e:
+                results[op] = {"error": str(e)}
+    if raw is not None and not temp_snapshot[0]:
+        log_temperature_reading(raw)
+    return results
+
+@app.route('/batch', methods=['POST'])
+def post_batch():
+    data = request.get_json(force=True)
+    ops = data.get("ops") if isinstance(data, dict) else None
+    if not isinstance(ops, list) or not ops:
+        return jsonify({"error": "JSON body must have 'ops' field (non-empty list)"}), 400
+    if not all(isinstance(op, str) for op in ops):
+        return jsonify({"error": "'ops' entries must be strings"}), 400
+    known = {"temp"} | set(BATCH_CACHED_OPS) | set(BATCH_REGISTER_OPS)
+    unknown = [op for op in ops if op not in known]
+    if unknown:
+        return jsonify({"error": "unknown operations: " + ", ".join(unknown)}), 400
+    return jsonify({"results": run_batch(ops)})
 
 @app.route('/address', methods=['PUT'])
 def put_address():
@@ -169,12 +929,20 @@ def put_address():
 
 @app.route('/')
 def health():
-    return jsonify({"status": "ok", "device": "MCP9808", "address": hex(current_i2c_address)})
+    resp = {"status": "ok", "device": "MCP9808", "address": hex(current_i2c_address)}
+    if history_store is not None:
+        resp["history"] = history_store.get_stats()
+    return jsonify(resp)
 
 def start_sampler():
     t = threading.Thread(target=temp_sampling_loop, daemon=True)
     t.start()
 
-if __name__ == '__main__':
+def start():
+    # Background work, run once by __main__ or by the I2C gateway
+    open_history()
     start_sampler()
+
+if __name__ == '__main__':
+    start()
     app.run(host=HTTP_HOST, port=HTTP_PORT)
\ No newline at end of file
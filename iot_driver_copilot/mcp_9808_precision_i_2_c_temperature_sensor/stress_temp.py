@@ -0,0 +1,159 @@
+import http.client
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import numpy as np
+import smbus2
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+# Hammers /temp from many threads while the sampler runs at 100 ms against a
+# simulated sensor, and reports request latency percentiles. The driver runs
+# on a threaded werkzeug server and the clients in a separate process, so
+# they load it the way real clients do rather than competing for its GIL.
+# Half the requests also page through the log, and STRESS_SLOW_CLIENTS
+# connections sit on half-sent PUT /limits bodies throughout, which must not
+# hold up anyone else. Exits non-zero when a request fails, when readers
+# starve the sampler (fewer than STRESS_MIN_SAMPLES of the expected samples,
+# or a gap over STRESS_MAX_GAP periods) or when p99 latency exceeds
+# STRESS_MAX_P99_MS. Runs without hardware or disk history. The sampler
+# period is a whole number of conversions, so the resolution is pinned to
+# 0.5 C (30 ms conversions) to keep it close to 100 ms.
+os.environ.setdefault("SAMPLING_INTERVAL_MS", "100")
+os.environ.setdefault("RESOLUTION", "0")
+os.environ.setdefault("HISTORY_DIR", "")
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import driver
+
+STRESS_THREADS = int(os.environ.get("STRESS_THREADS", 32))
+STRESS_SECONDS = float(os.environ.get("STRESS_SECONDS", 10))
+STRESS_PAGE = int(os.environ.get("STRESS_PAGE", 100))
+STRESS_BUS_LATENCY_MS = float(os.environ.get("STRESS_BUS_LATENCY_MS", 1))
+STRESS_MIN_SAMPLES = float(os.environ.get("STRESS_MIN_SAMPLES", 0.9))  # fraction of expected
+STRESS_MAX_GAP = float(os.environ.get("STRESS_MAX_GAP", 2))  # sampler periods
+STRESS_MAX_P99_MS = float(os.environ.get("STRESS_MAX_P99_MS", 100))
+STRESS_SLOW_CLIENTS = int(os.environ.get("STRESS_SLOW_CLIENTS", 4))
+STRESS_TIMEOUT_S = 5.0  # a request slower than this counts as failed
+
+class SimulatedSMBus:
+    # Stands in for smbus2.SMBus: a slow-ish ambient read around 22 C
+    def __init__(self, bus_id):
+        self.bus_id = bus_id
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    def write_byte_data(self, addr, reg, value):
+        pass
+
+    def write_word_data(self, addr, reg, value):
+        pass
+
+    def read_word_data(self, addr, reg):
+        time.sleep(STRESS_BUS_LATENCY_MS / 1000.0)
+        value = 22 * 16 + int(time.monotonic() * 10) % 16
+        return ((value << 8) & 0xFF00) | (value >> 8)  # wire order, swapped by read_word
+
+class KeepAliveHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_request(self, *args):
+        pass
+
+def client(port, deadline, latencies, errors, paged):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=STRESS_TIMEOUT_S)
+    url = f"/temp?log=1&limit={STRESS_PAGE}" if paged else "/temp"
+    own = []
+    while time.monotonic() < deadline:
+        t0 = time.perf_counter()
+        try:
+            conn.request("GET", url)
+            resp = conn.getresponse()
+            resp.read()
+        except OSError as e:
+            errors.append(repr(e))
+            conn.close()
+            continue
+        own.append(time.perf_counter() - t0)
+        if resp.status != 200:
+            errors.append(resp.status)
+    conn.close()
+    latencies.extend(own)
+
+def run_clients(port, results):
+    # Client process: STRESS_THREADS connections for STRESS_SECONDS
+    deadline = time.monotonic() + STRESS_SECONDS
+    latencies = []
+    errors = []
+    threads = [threading.Thread(target=client, args=(port, deadline, latencies, errors, i % 2 == 1))
+               for i in range(STRESS_THREADS)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    results.put((latencies, errors))
+
+def slow_client(port):
+    # Sends the headers and part of the body, then stalls
+    sock = socket.create_connection(("127.0.0.1", port))
+    sock.sendall(b"PUT /limits HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+                 b"Content-Length: 64\r\n\r\n{\"upper\": ")
+    return sock
+
+def main():
+    smbus2.SMBus = SimulatedSMBus
+    server = make_server("127.0.0.1", 0, driver.app, threaded=True, request_handler=KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    driver.start_sampler()
+    time.sleep(1)  # let the log fill past one page
+    slow = [slow_client(server.port) for _ in range(STRESS_SLOW_CLIENTS)]
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=run_clients, args=(server.port, results))
+    samples0 = driver.temp_snapshot[0]
+    t0_ms = int(time.time() * 1000)
+    started = time.monotonic()
+    proc.start()
+    latencies, errors = results.get()
+    proc.join()
+    samples = driver.temp_snapshot[0] - samples0
+    elapsed = time.monotonic() - started
+    for sock in slow:
+        sock.close()
+    server.shutdown()
+    timestamps, _ = driver.temp_log.select(t0_ms, int(time.time() * 1000))
+    gap_ms = np.diff(timestamps).max() if len(timestamps) > 1 else float("inf")
+    period = driver.sample_period_s()
+    ms = np.array(latencies) * 1000
+    expected = elapsed / period
+    p99 = np.percentile(ms, 99) if len(ms) else float("inf")
+    print(f"{STRESS_THREADS} threads, {STRESS_SLOW_CLIENTS} slow clients, {STRESS_SECONDS:.0f} s, "
+          f"page {STRESS_PAGE}, sampler {period * 1000:.0f} ms")
+    print(f"requests {len(ms)} ({len(ms) / STRESS_SECONDS:.0f}/s), errors {len(errors)}")
+    if len(ms):
+        print(f"latency ms p50 {np.percentile(ms, 50):.2f} p99 {p99:.2f} max {ms.max():.2f}")
+    print(f"sampler logged {samples} samples, expected ~{expected:.0f}, max gap {gap_ms:.0f} ms")
+    failures = []
+    if errors:
+        failures.append(f"{len(errors)} requests failed, first: {errors[0]}")
+    if samples < STRESS_MIN_SAMPLES * expected:
+        failures.append(f"sampler logged {samples} of ~{expected:.0f} samples (< {STRESS_MIN_SAMPLES:.0%})")
+    if gap_ms > STRESS_MAX_GAP * period * 1000:
+        failures.append(f"sampler gap {gap_ms:.0f} ms > {STRESS_MAX_GAP:g} periods")
+    if p99 > STRESS_MAX_P99_MS:
+        failures.append(f"p99 latency {p99:.1f} ms > {STRESS_MAX_P99_MS:g} ms")
+    for failure in failures:
+        print("FAIL:", failure)
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
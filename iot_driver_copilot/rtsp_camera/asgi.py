@@ -0,0 +1,118 @@
+import asyncio
+import os
+import sys
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import driver
+
+# ASGI serving mode: MJPEG streams run as coroutines woken by the capture
+# threads, so an idle viewer holds a socket but no OS thread. Every other
+# route is the unchanged Flask app behind a small WSGI thread pool.
+# Run with `python asgi.py` or `uvicorn asgi:app`.
+WSGI_WORKERS = int(os.environ.get('WSGI_WORKERS', 8))
+
+class LoopNotifier:
+    # Bridges CameraSession listeners (capture thread) into one event loop
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def notify(self):
+        self.loop.call_soon_threadsafe(self.wake)
+
+    def wake(self):
+        future, self.future = self.future, self.loop.create_future()
+        future.set_result(None)
+
+    async def wait(self, future, timeout):
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+notifiers = {}
+
+def notifier_for(session):
+    notifier = notifiers.get(session.camera_id)
+    if notifier is None:
+        notifier = LoopNotifier(asyncio.get_running_loop())
+        notifiers[session.camera_id] = notifier
+        session.add_listener(notifier.notify)
+    return notifier
+
+async def gen_mjpeg(session, variant=None):
+    loop = asyncio.get_running_loop()
+    notifier = notifier_for(session)
+    session.add_viewer()
+    entry = session.acquire_variant(variant) if variant else None
+    try:
+        last_seq = 0
+        while True:
+            # Take the future before checking so a publish in between is not missed
+            future = notifier.future
+            last_seq, jpeg, running = session.wait_for_jpeg(last_seq, timeout=0)
+            if not running:
+                break
+            if jpeg is None:
+                await notifier.wait(future, 1.0)
+                continue
+            if entry is not None:
+                jpeg = await loop.run_in_executor(None, session.variant_jpeg, variant, entry)
+                if jpeg is None:
+                    continue
+            # Separate sends so the shared JPEG bytes are never copied per viewer
+            yield b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+            yield jpeg
+            yield b'\r\n'
+    finally:
+        if entry is not None:
+            session.release_variant(entry)
+        session.remove_viewer()
+
+def mjpeg_response(session, variant):
+    return StreamingResponse(gen_mjpeg(session, variant),
+                             media_type='multipart/x-mixed-replace; boundary=frame')
+
+def variant_error(e):
+    return JSONResponse({"error": f"Invalid variant: {e}"}, status_code=400)
+
+async def stream_live(request):
+    try:
+        variant = driver.parse_variant(request.query_params)
+    except ValueError as e:
+        return variant_error(e)
+    session = driver.camera_manager.get(driver.DEFAULT_CAMERA_ID)
+    with session.lock:
+        if not session.running:
+            return Response("Stream is not running.", status_code=503)
+    return mjpeg_response(session, variant)
+
+async def camera_stream_live(request):
+    session = driver.camera_manager.get(request.path_params['camera_id'])
+    if session is None:
+        return JSONResponse({"error": "Unknown camera"}, status_code=404)
+    try:
+        variant = driver.parse_variant(request.query_params)
+    except ValueError as e:
+        return variant_error(e)
+    # start() may wait for the first frame; keep that off the event loop
+    await asyncio.get_running_loop().run_in_executor(None, session.start)
+    with session.lock:
+        error = session.error
+    if error:
+        return Response(error, status_code=503)
+    return mjpeg_response(session, variant)
+
+app = Starlette(routes=[
+    Route('/stream/live', stream_live, methods=['GET']),
+    Route('/cameras/{camera_id}/stream/live', camera_stream_live, methods=['GET']),
+    Mount('/', app=WSGIMiddleware(driver.app, workers=WSGI_WORKERS)),
+])
+
+if __name__ == '__main__':
+    uvicorn.run(app, host=driver.HTTP_SERVER_HOST, port=driver.HTTP_SERVER_PORT)
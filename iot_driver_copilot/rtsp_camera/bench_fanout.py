@@ -0,0 +1,87 @@
+import os
+import sys
+import threading
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import driver
+
+# Benchmark configuration
+BENCH_WIDTH = int(os.environ.get('BENCH_WIDTH', 1920))
+BENCH_HEIGHT = int(os.environ.get('BENCH_HEIGHT', 1080))
+BENCH_SOURCE_FPS = float(os.environ.get('BENCH_SOURCE_FPS', 30))
+BENCH_SECONDS = float(os.environ.get('BENCH_SECONDS', 5))
+BENCH_VIEWERS = [int(n) for n in os.environ.get('BENCH_VIEWERS', '0,1,5,10,20').split(',')]
+
+class SyntheticCapture:
+    # Stands in for cv2.VideoCapture so the benchmark needs no camera;
+    # grab() blocks like a live source delivering BENCH_SOURCE_FPS
+    def __init__(self, url):
+        rng = np.random.default_rng(0)
+        self.frames = [rng.integers(0, 255, (BENCH_HEIGHT, BENCH_WIDTH, 3), dtype=np.uint8)
+                       for _ in range(4)]
+        self.index = 0
+        self.next_frame = time.monotonic()
+
+    def isOpened(self):
+        return True
+
+    def set(self, prop, value):
+        return False
+
+    def grab(self):
+        self.next_frame += 1.0 / BENCH_SOURCE_FPS
+        delay = self.next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self.index = (self.index + 1) % len(self.frames)
+        return True
+
+    def retrieve(self):
+        return True, self.frames[self.index]
+
+    def read(self):
+        self.grab()
+        return self.retrieve()
+
+    def release(self):
+        pass
+
+def viewer(session, stop_event, counter):
+    for chunk in session.gen_mjpeg():
+        counter[0] += 1
+        if stop_event.is_set():
+            break
+
+def run(session, viewers):
+    stop_event = threading.Event()
+    counters = [[0] for _ in range(viewers)]
+    threads = [threading.Thread(target=viewer, args=(session, stop_event, c), daemon=True) for c in counters]
+    for t in threads:
+        t.start()
+    cpu0, wall0 = time.process_time(), time.monotonic()
+    time.sleep(BENCH_SECONDS)
+    cpu1, wall1 = time.process_time(), time.monotonic()
+    stop_event.set()
+    delivered = sum(c[0] for c in counters)
+    return (cpu1 - cpu0) / (wall1 - wall0) * 100.0, delivered / (wall1 - wall0)
+
+def main():
+    driver.cv2.VideoCapture = SyntheticCapture
+    session = driver.camera_manager.get(driver.DEFAULT_CAMERA_ID)
+    session.start(pinned=True)
+    print(f"{BENCH_WIDTH}x{BENCH_HEIGHT}, {BENCH_SECONDS:.0f}s per step")
+    print(f"{'viewers':>8} {'cpu %':>8} {'cpu %/viewer':>13} {'frames/s out':>13}")
+    baseline = None
+    for n in BENCH_VIEWERS:
+        cpu, fps = run(session, n)
+        if baseline is None:
+            baseline = cpu
+        per_viewer = (cpu - baseline) / n if n else 0.0
+        print(f"{n:>8} {cpu:>8.1f} {per_viewer:>13.2f} {fps:>13.1f}")
+    print(session.status()["stats"])
+    session.stop()
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,9 @@
 import os
+import json
 import threading
 import io
 import time
+from collections import deque
 from flask import Flask, Response, jsonify, send_file, request
 import cv2
 import numpy as np
@@ -17,19 +19,14 @@ CAMERA_PASS = os.environ.get('CAMERA_PASS', '')
 CAMERA_STREAM_PATH = os.environ.get('CAMERA_STREAM_PATH', 'Streaming/Channels/101')
 HTTP_SERVER_HOST = os.environ.get('HTTP_SERVER_HOST', '0.0.0.0')
 HTTP_SERVER_PORT = int(os.environ.get('HTTP_SERVER_PORT', 8080))
-
-# Stream state
-stream_state = {
-    "running": False,
-    "thread": None,
-    "frame": None,
-    "last_frame_time": 0,
-    "capture_requested": False,
-    "capture_image": None,
-    "error": None
-}
-
-frame_lock = threading.Lock()
+CAPTURE_MODE = os.environ.get('CAPTURE_MODE', 'grab')  # 'grab' drains the backend buffer, 'read' decodes every frame
+TARGET_FPS = float(os.environ.get('TARGET_FPS', 25))  # 0 publishes every decoded frame
+CAMERAS = os.environ.get('CAMERAS', '')  # JSON object of extra cameras, e.g. {"gate": "rtsp://..."}
+CAMERA_IDLE_TIMEOUT = float(os.environ.get('CAMERA_IDLE_TIMEOUT', 30))  # seconds without viewers before an on-demand camera stops
+FRAME_RING_SIZE = int(os.environ.get('FRAME_RING_SIZE', 50))  # encoded frames kept for pre-trigger /capture
+FRAME_RING_BYTES = int(os.environ.get('FRAME_RING_BYTES', 16 * 1024 * 1024))
+VARIANT_IDLE_TIMEOUT = float(os.environ.get('VARIANT_IDLE_TIMEOUT', 10))  # seconds an unwatched width/quality variant stays cached
+DEFAULT_CAMERA_ID = 'default'
 
 def build_rtsp_url():
     if RTSP_URL:
@@ -39,101 +36,440 @@ def build_rtsp_url():
         user_pass = f"{CAMERA_USER}:{CAMERA_PASS}@"
     return f"rtsp://{user_pass}{CAMERA_IP}:{CAMERA_RTSP_PORT}/{CAMERA_STREAM_PATH}"
 
-def video_stream_worker():
-    rtsp_url = build_rtsp_url()
-    cap = cv2.VideoCapture(rtsp_url)
-    if not cap.isOpened():
-        with frame_lock:
-            stream_state["error"] = "Failed to open RTSP stream"
-        return
-    with frame_lock:
-        stream_state["error"] = None
-    while stream_state["running"]:
-        ret, frame = cap.read()
-        if not ret:
-            time.sleep(0.1)
-            continue
-        with frame_lock:
-            stream_state["frame"] = frame
-            stream_state["last_frame_time"] = time.time()
-            if stream_state["capture_requested"]:
-                stream_state["capture_image"] = frame.copy()
-                stream_state["capture_requested"] = False
-        # Slow down the loop for web streaming, ~25fps
-        time.sleep(0.04)
-    cap.release()
-
-def start_stream():
-    with frame_lock:
-        if stream_state["running"]:
-            return False
-        stream_state["running"] = True
-        stream_state["thread"] = threading.Thread(target=video_stream_worker, daemon=True)
-        stream_state["thread"].start()
-    # Wait for the worker to start and get at least one frame or error
-    t0 = time.time()
-    while True:
-        with frame_lock:
-            if stream_state["frame"] is not None or stream_state["error"]:
-                break
-        if time.time() - t0 > 10:
-            break
-        time.sleep(0.1)
-    return True
-
-def stop_stream():
-    with frame_lock:
-        stream_state["running"] = False
-    if stream_state["thread"]:
-        stream_state["thread"].join(timeout=2)
-    with frame_lock:
-        stream_state["thread"] = None
-        stream_state["frame"] = None
-        stream_state["capture_image"] = None
-    return True
-
-def gen_mjpeg():
-    while True:
-        with frame_lock:
-            frame = stream_state["frame"].copy() if stream_state["frame"] is not None else None
-            running = stream_state["running"]
-        if not running:
-            break
-        if frame is not None:
-            ret, jpeg = cv2.imencode('.jpg', frame)
+def new_capture_stats():
+    return {
+        "mode": CAPTURE_MODE,
+        "target_fps": TARGET_FPS,
+        "frames_grabbed": 0,
+        "frames_decoded": 0,
+        "frames_dropped": 0,
+        "latency_ms": 0.0,
+        "latency_avg_ms": 0.0
+    }
+
+def parse_variant(args):
+    # (width, quality) from query args, or None for the full-size default encode
+    width = args.get('width')
+    quality = args.get('quality')
+    width = int(width) if width else None
+    quality = int(quality) if quality else None
+    if width is not None and width <= 0:
+        raise ValueError("width must be a positive integer")
+    if quality is not None and not (1 <= quality <= 100):
+        raise ValueError("quality must be between 1 and 100")
+    if width is None and quality is None:
+        return None
+    return (width, quality)
+
+def encode_frame(frame, variant=None):
+    width, quality = variant or (None, None)
+    if width and width < frame.shape[1]:
+        height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+        frame = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality] if quality else []
+    ok, jpeg = cv2.imencode('.jpg', frame, params)
+    return jpeg.tobytes() if ok else None
+
+class CameraSession:
+    def __init__(self, camera_id, rtsp_url):
+        self.camera_id = camera_id
+        self.rtsp_url = rtsp_url
+        self.lock = threading.Lock()
+        # Signalled by the worker whenever a new encoded frame is published
+        self.cond = threading.Condition(self.lock)
+        # Extra callbacks run by the worker after each publish (used by the ASGI server)
+        self.listeners = []
+        self.running = False
+        self.generation = 0
+        self.thread = None
+        self.frame = None
+        self.jpeg = None
+        self.seq = 0
+        # (seq, monotonic time, jpeg bytes), oldest first, bounded by count and bytes
+        self.ring = deque()
+        self.ring_bytes = 0
+        # (width, quality) -> lazily encoded copy of the latest frame, shared by its subscribers
+        self.variants = {}
+        self.last_frame_time = 0
+        self.error = None
+        self.stats = {}
+        # Explicitly started sessions stay up; on-demand ones stop when idle
+        self.pinned = False
+        self.viewers = 0
+        self.last_active = time.monotonic()
+
+    def active(self, generation):
+        return self.running and self.generation == generation
+
+    def worker(self, generation):
+        cap = cv2.VideoCapture(self.rtsp_url)
+        if not cap.isOpened():
+            with self.lock:
+                self.error = "Failed to open RTSP stream"
+                # Let the next start() begin a new generation
+                if self.generation == generation:
+                    self.running = False
+                self.cond.notify_all()
+            return
+        drain = CAPTURE_MODE == 'grab'
+        if drain:
+            # Not every backend honours this, grab() below drains whatever is queued
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        stats = new_capture_stats()
+        with self.lock:
+            self.error = None
+            self.stats = dict(stats)
+        period = 1.0 / TARGET_FPS if TARGET_FPS > 0 else 0.0
+        next_deadline = time.monotonic()
+        while self.active(generation):
+            if drain:
+                # grab() only demuxes; frames that arrive before the deadline are
+                # skipped without paying for retrieve()/decode
+                if not cap.grab():
+                    time.sleep(0.1)
+                    continue
+                t_grab = time.monotonic()
+                stats["frames_grabbed"] += 1
+                if t_grab < next_deadline:
+                    stats["frames_dropped"] += 1
+                    continue
+                ret, frame = cap.retrieve()
+            else:
+                ret, frame = cap.read()
+                t_grab = time.monotonic()
+                if ret:
+                    stats["frames_grabbed"] += 1
             if not ret:
+                time.sleep(0.1)
                 continue
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + jpeg.tobytes() + b'\r\n')
-        else:
-            time.sleep(0.04)
+            stats["frames_decoded"] += 1
+            # Encode once here, outside the lock; every viewer shares these bytes
+            jpeg = encode_frame(frame)
+            latency_ms = (time.monotonic() - t_grab) * 1000.0
+            stats["latency_ms"] = round(latency_ms, 2)
+            stats["latency_avg_ms"] = round(0.9 * stats["latency_avg_ms"] + 0.1 * latency_ms, 2)
+            with self.lock:
+                if not self.active(generation):
+                    break
+                self.frame = frame
+                self.last_frame_time = time.time()
+                self.stats = dict(stats)
+                if jpeg is not None:
+                    self.jpeg = jpeg
+                    self.seq += 1
+                    self.push_ring(self.seq, t_grab, self.jpeg)
+                    self.cond.notify_all()
+                listeners = list(self.listeners)
+            for listener in listeners:
+                listener()
+            # Pace against a monotonic deadline; never try to catch up on missed slots
+            next_deadline += period
+            now = time.monotonic()
+            if next_deadline < now:
+                next_deadline = now
+            elif not drain:
+                time.sleep(next_deadline - now)
+        cap.release()
+        with self.lock:
+            self.cond.notify_all()
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener()
+
+    def push_ring(self, seq, timestamp, jpeg):
+        # Caller holds self.lock
+        self.ring.append((seq, timestamp, jpeg))
+        self.ring_bytes += len(jpeg)
+        while len(self.ring) > 1 and (len(self.ring) > FRAME_RING_SIZE
+                                      or self.ring_bytes > FRAME_RING_BYTES):
+            self.ring_bytes -= len(self.ring.popleft()[2])
+
+    def start(self, pinned=False):
+        with self.lock:
+            self.last_active = time.monotonic()
+            if pinned:
+                self.pinned = True
+            if self.running:
+                return False
+            self.running = True
+            # The wait below must see this generation's first frame or error
+            self.error = None
+            self.frame = None
+            self.generation += 1
+            self.thread = threading.Thread(target=self.worker, args=(self.generation,), daemon=True)
+            self.thread.start()
+        # Wait for the worker to start and get at least one frame or error
+        t0 = time.time()
+        while True:
+            with self.lock:
+                if self.frame is not None or self.error:
+                    break
+            if time.time() - t0 > 10:
+                break
+            time.sleep(0.1)
+        return True
+
+    def stop(self):
+        with self.lock:
+            self.pinned = False
+            thread, generation = self.signal_stop()
+        self.join_worker(thread, generation)
+        return True
+
+    def stop_if_idle(self, idle_timeout):
+        with self.lock:
+            if (not self.running or self.pinned or self.viewers > 0
+                    or time.monotonic() - self.last_active < idle_timeout):
+                return False
+            thread, generation = self.signal_stop()
+        self.join_worker(thread, generation)
+        return True
+
+    def signal_stop(self):
+        # Caller holds self.lock
+        self.running = False
+        self.cond.notify_all()
+        for listener in self.listeners:
+            listener()
+        return self.thread, self.generation
+
+    def join_worker(self, thread, generation):
+        if thread:
+            thread.join(timeout=2)
+        with self.lock:
+            # A viewer may have restarted the session while we were joining
+            if self.generation == generation and not self.running:
+                self.thread = None
+                self.frame = None
+                self.jpeg = None
+                self.ring.clear()
+                self.ring_bytes = 0
+                self.variants.clear()
+
+    def add_listener(self, callback):
+        with self.lock:
+            self.listeners.append(callback)
+
+    def add_viewer(self):
+        with self.lock:
+            self.viewers += 1
+            self.last_active = time.monotonic()
+
+    def remove_viewer(self):
+        with self.lock:
+            self.viewers -= 1
+            self.last_active = time.monotonic()
+
+    def acquire_variant(self, variant, subscribe=True):
+        with self.lock:
+            entry = self.variants.get(variant)
+            if entry is None:
+                entry = {"lock": threading.Lock(), "seq": 0, "jpeg": None, "subscribers": 0}
+                self.variants[variant] = entry
+            if subscribe:
+                entry["subscribers"] += 1
+            entry["last_used"] = time.monotonic()
+            return entry
+
+    def release_variant(self, entry):
+        with self.lock:
+            entry["subscribers"] -= 1
+            entry["last_used"] = time.monotonic()
+
+    def variant_jpeg(self, variant, entry):
+        # Resize/encode the latest frame at most once per source frame; concurrent
+        # subscribers of the same variant wait on entry["lock"] and reuse the result
+        with self.lock:
+            seq, frame = self.seq, self.frame
+            entry["last_used"] = time.monotonic()
+        if frame is None:
+            return None
+        with entry["lock"]:
+            if entry["seq"] != seq:
+                jpeg = encode_frame(frame, variant)
+                if jpeg is not None:
+                    entry["seq"], entry["jpeg"] = seq, jpeg
+            return entry["jpeg"]
+
+    def evict_variants(self, idle_timeout):
+        now = time.monotonic()
+        with self.lock:
+            for variant, entry in list(self.variants.items()):
+                if entry["subscribers"] == 0 and now - entry["last_used"] > idle_timeout:
+                    del self.variants[variant]
+
+    def wait_for_jpeg(self, last_seq, timeout=1.0):
+        # Block until the worker publishes a frame newer than last_seq.
+        # Returns (seq, jpeg, running); jpeg is None on timeout or shutdown.
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > last_seq or not self.running, timeout=timeout)
+            if self.seq > last_seq and self.jpeg is not None:
+                return self.seq, self.jpeg, self.running
+            return last_seq, None, self.running
+
+    def gen_mjpeg(self, variant=None):
+        self.add_viewer()
+        entry = self.acquire_variant(variant) if variant else None
+        try:
+            last_seq = 0
+            while True:
+                last_seq, jpeg, running = self.wait_for_jpeg(last_seq)
+                if not running:
+                    break
+                if jpeg is not None and entry is not None:
+                    jpeg = self.variant_jpeg(variant, entry)
+                if jpeg is not None:
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+        finally:
+            if entry is not None:
+                self.release_variant(entry)
+            self.remove_viewer()
+
+    def capture(self, before_ms=0, variant=None):
+        # Served straight from already-encoded frames; never waits on the worker.
+        # Returns (jpeg, age_ms) or None when no frame has been published yet.
+        with self.lock:
+            self.last_active = time.monotonic()
+            if not self.ring:
+                return None
+            now = time.monotonic()
+            seq, timestamp, jpeg = self.ring[-1]
+            if before_ms > 0:
+                target = now - before_ms / 1000.0
+                # Newest frame at or before the target, else the oldest we still have
+                seq, timestamp, jpeg = self.ring[0]
+                for entry in reversed(self.ring):
+                    if entry[1] <= target:
+                        seq, timestamp, jpeg = entry
+                        break
+            latest = seq == self.seq
+        if variant:
+            if latest:
+                jpeg = self.variant_jpeg(variant, self.acquire_variant(variant, subscribe=False))
+            else:
+                # Pre-trigger frames only exist as full-size JPEG in the ring
+                jpeg = encode_frame(cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR), variant)
+            if jpeg is None:
+                return None
+        return jpeg, round((now - timestamp) * 1000.0, 1)
+
+    def status(self):
+        with self.lock:
+            return {
+                "camera_id": self.camera_id,
+                "streaming": self.running,
+                "pinned": self.pinned,
+                "viewers": self.viewers,
+                "error": self.error,
+                "ring_frames": len(self.ring),
+                "ring_bytes": self.ring_bytes,
+                "variants": [
+                    {"width": v[0], "quality": v[1], "subscribers": e["subscribers"]}
+                    for v, e in self.variants.items()
+                ],
+                "stats": dict(self.stats)
+            }
+
+class CameraManager:
+    def __init__(self, idle_timeout=CAMERA_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.reaper = None
+
+    def add(self, camera_id, rtsp_url):
+        with self.lock:
+            session = self.sessions.get(camera_id)
+            if session is None:
+                session = CameraSession(camera_id, rtsp_url)
+                self.sessions[camera_id] = session
+            return session
+
+    def get(self, camera_id):
+        with self.lock:
+            return self.sessions.get(camera_id)
+
+    def all(self):
+        with self.lock:
+            return list(self.sessions.values())
+
+    def start_reaper(self):
+        with self.lock:
+            if self.reaper is not None:
+                return
+            self.reaper = threading.Thread(target=self.reap_idle, daemon=True)
+            self.reaper.start()
+
+    def reap_idle(self):
+        # One thread for all cameras; only sessions with live capture threads cost anything
+        while True:
+            time.sleep(min(1.0, self.idle_timeout))
+            for session in self.all():
+                session.stop_if_idle(self.idle_timeout)
+                session.evict_variants(VARIANT_IDLE_TIMEOUT)
+
+def load_cameras(manager):
+    manager.add(DEFAULT_CAMERA_ID, build_rtsp_url())
+    if CAMERAS:
+        for camera_id, rtsp_url in json.loads(CAMERAS).items():
+            manager.add(camera_id, rtsp_url)
+
+camera_manager = CameraManager()
+load_cameras(camera_manager)
+camera_manager.start_reaper()
+
+def unknown_camera():
+    return jsonify({"error": "Unknown camera"}), 404
+
+def variant_error(e):
+    return jsonify({"error": f"Invalid variant: {e}"}), 400
+
+def capture_response(session):
+    try:
+        before_ms = float(request.args.get('before_ms', 0))
+    except ValueError:
+        return jsonify({"error": "before_ms must be a number"}), 400
+    try:
+        variant = parse_variant(request.args)
+    except ValueError as e:
+        return variant_error(e)
+    captured = session.capture(before_ms, variant)
+    if captured is None:
+        return jsonify({"error": "Failed to capture image"}), 500
+    jpeg, age_ms = captured
+    return Response(jpeg, mimetype='image/jpeg', headers={"X-Frame-Age-Ms": str(age_ms)})
 
 @app.route('/stream', methods=['GET'])
 def get_stream_status():
-    with frame_lock:
-        running = stream_state["running"]
-        error = stream_state["error"]
-    rtsp_url = build_rtsp_url()
+    status = camera_manager.get(DEFAULT_CAMERA_ID).status()
     return jsonify({
-        "streaming": running,
-        "rtsp_url": rtsp_url,
+        "streaming": status["streaming"],
+        "rtsp_url": build_rtsp_url(),
         "http_mjpeg_url": "/stream/live",
-        "error": error
+        "error": status["error"],
+        "stats": status["stats"]
     })
 
 @app.route('/stream/live', methods=['GET'])
 def stream_live():
-    with frame_lock:
-        if not stream_state["running"]:
+    try:
+        variant = parse_variant(request.args)
+    except ValueError as e:
+        return variant_error(e)
+    session = camera_manager.get(DEFAULT_CAMERA_ID)
+    with session.lock:
+        if not session.running:
             return Response("Stream is not running.", status=503)
-    return Response(gen_mjpeg(),
+    return Response(session.gen_mjpeg(variant),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
 @app.route('/stream/start', methods=['POST'])
 def start_stream_api():
-    started = start_stream()
-    with frame_lock:
-        error = stream_state["error"]
+    session = camera_manager.get(DEFAULT_CAMERA_ID)
+    started = session.start(pinned=True)
+    with session.lock:
+        error = session.error
     if error:
         return jsonify({"started": False, "error": error}), 500
     return jsonify({
@@ -144,33 +480,79 @@ def start_stream_api():
 
 @app.route('/stream/stop', methods=['POST'])
 def stop_stream_api():
-    stopped = stop_stream()
+    stopped = camera_manager.get(DEFAULT_CAMERA_ID).stop()
     return jsonify({"stopped": stopped})
 
 @app.route('/capture', methods=['POST'])
 def capture_image():
-    with frame_lock:
-        if not stream_state["running"]:
+    session = camera_manager.get(DEFAULT_CAMERA_ID)
+    with session.lock:
+        if not session.running:
             return jsonify({"error": "Stream is not running"}), 503
-        stream_state["capture_requested"] = True
-
-    # Wait for capture to be processed
-    t0 = time.time()
-    while True:
-        with frame_lock:
-            img = stream_state["capture_image"]
-        if img is not None or time.time() - t0 > 2:
-            break
-        time.sleep(0.05)
-
-    with frame_lock:
-        if stream_state["capture_image"] is None:
-            return jsonify({"error": "Failed to capture image"}), 500
-        ret, jpeg = cv2.imencode('.jpg', stream_state["capture_image"])
-        stream_state["capture_image"] = None
-    if not ret:
-        return jsonify({"error": "Failed to encode image"}), 500
-    return Response(jpeg.tobytes(), mimetype='image/jpeg')
+    return capture_response(session)
+
+@app.route('/cameras', methods=['GET'])
+def list_cameras():
+    return jsonify({"cameras": [session.status() for session in camera_manager.all()]})
+
+@app.route('/cameras/<camera_id>/stream', methods=['GET'])
+def camera_stream_status(camera_id):
+    session = camera_manager.get(camera_id)
+    if session is None:
+        return unknown_camera()
+    status = session.status()
+    status["http_mjpeg_url"] = f"/cameras/{camera_id}/stream/live"
+    return jsonify(status)
+
+@app.route('/cameras/<camera_id>/stream/live', methods=['GET'])
+def camera_stream_live(camera_id):
+    session = camera_manager.get(camera_id)
+    if session is None:
+        return unknown_camera()
+    try:
+        variant = parse_variant(request.args)
+    except ValueError as e:
+        return variant_error(e)
+    # start() refreshes last_active, so the reaper leaves the session alone
+    # until gen_mjpeg() registers the viewer
+    session.start()
+    with session.lock:
+        error = session.error
+    if error:
+        return Response(error, status=503)
+    return Response(session.gen_mjpeg(variant),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/cameras/<camera_id>/stream/start', methods=['POST'])
+def camera_stream_start(camera_id):
+    session = camera_manager.get(camera_id)
+    if session is None:
+        return unknown_camera()
+    started = session.start(pinned=True)
+    with session.lock:
+        error = session.error
+    if error:
+        return jsonify({"started": False, "error": error}), 500
+    return jsonify({"started": started, "http_mjpeg_url": f"/cameras/{camera_id}/stream/live"})
+
+@app.route('/cameras/<camera_id>/stream/stop', methods=['POST'])
+def camera_stream_stop(camera_id):
+    session = camera_manager.get(camera_id)
+    if session is None:
+        return unknown_camera()
+    return jsonify({"stopped": session.stop()})
+
+@app.route('/cameras/<camera_id>/capture', methods=['POST'])
+def camera_capture(camera_id):
+    session = camera_manager.get(camera_id)
+    if session is None:
+        return unknown_camera()
+    session.start()
+    with session.lock:
+        error = session.error
+    if error:
+        return jsonify({"error": error}), 503
+    return capture_response(session)
 
 if __name__ == '__main__':
     app.run(host=HTTP_SERVER_HOST, port=HTTP_SERVER_PORT, threaded=True)
\ No newline at end of file
@@ -0,0 +1,237 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+
+# Durable on-disk sample history shared by the temperature drivers.
+#
+# A store is a directory of append-only segment files named after the
+# timestamp of their first sample (<ms:016d>.seg). Each segment is a 16-byte
+# header <4s magic b"SSEG", H version, H record size, Q created ms> followed by
+# fixed 12-byte records <q timestamp ms, h value, H check>, where check is the
+# low 16 bits of the CRC-32 of the first 10 bytes. Timestamps never decrease
+# across the store, so a range query is a binary search over memory-mapped
+# records with no parsing.
+#
+# Appends go to an in-memory buffer that is written out with one os.write per
+# batch (every flush_interval_s or flush_records records) and fsynced at most
+# every fsync_interval_s, so a crash loses at most that window. Recovery on
+# open drops a partial trailing record plus any trailing records whose check
+# fails (e.g. zero-filled blocks after a power cut) and truncates the file.
+
+SEGMENT_MAGIC = b"SSEG"
+SEGMENT_VERSION = 1
+SEGMENT_HEADER = struct.Struct("<4sHHQ")
+RECORD = struct.Struct("<qhH")
+RECORD_DTYPE = np.dtype([("ts", "<i8"), ("value", "<i2"), ("check", "<u2")])
+SEGMENT_SUFFIX = ".seg"
+
+def record_check(ts, value):
+    return zlib.crc32(struct.pack("<qh", ts, value)) & 0xFFFF
+
+def pack_record(ts, value):
+    return RECORD.pack(ts, value, record_check(ts, value))
+
+class SampleStore:
+    def __init__(self, path, segment_bytes=4 << 20, segment_seconds=86400,
+                 retention_bytes=256 << 20, retention_seconds=42 * 86400,
+                 flush_interval_s=5.0, flush_records=512, fsync_interval_s=30.0):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.retention_bytes = retention_bytes
+        self.retention_seconds = retention_seconds
+        self.flush_interval_s = flush_interval_s
+        self.flush_records = flush_records
+        self.fsync_interval_s = fsync_interval_s
+        self.lock = threading.Lock()
+        self.pending = bytearray()
+        self.pending_count = 0
+        self.last_flush = time.monotonic()
+        self.last_fsync = self.last_flush
+        self.fd = None
+        self.segments = []  # [start ms, file name, size bytes], oldest first
+        self.last_ts = None
+        self.stats = {"flushes": 0, "fsyncs": 0, "rotations": 0, "removed": 0, "recovered_bytes": 0}
+        os.makedirs(path, exist_ok=True)
+        self.load_segments()
+
+    def load_segments(self):
+        names = sorted(n for n in os.listdir(self.path) if n.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            full = os.path.join(self.path, name)
+            size = self.recover(full)
+            if size is None:
+                os.remove(full)
+                continue
+            self.segments.append([int(name[:-len(SEGMENT_SUFFIX)]), name, size])
+        for segment in reversed(self.segments):
+            if segment[2] > SEGMENT_HEADER.size:
+                self.last_ts = self.read_last_ts(segment)
+                break
+
+    def recover(self, full):
+        # Returns the valid size of a segment after truncating a torn tail, or
+        # None if the file has no usable header
+        with open(full, "r+b") as f:
+            header = f.read(SEGMENT_HEADER.size)
+            if len(header) < SEGMENT_HEADER.size:
+                return None
+            magic, version, record_size, _ = SEGMENT_HEADER.unpack(header)
+            if magic != SEGMENT_MAGIC or version != SEGMENT_VERSION or record_size != RECORD.size:
+                return None
+            size = os.fstat(f.fileno()).st_size
+            valid = size - (size - SEGMENT_HEADER.size) % RECORD.size
+            while valid > SEGMENT_HEADER.size:
+                f.seek(valid - RECORD.size)
+                ts, value, check = RECORD.unpack(f.read(RECORD.size))
+                if check == record_check(ts, value) and ts > 0:
+                    break
+                valid -= RECORD.size
+            if valid != size:
+                f.truncate(valid)
+                os.fsync(f.fileno())
+                self.stats["recovered_bytes"] += size - valid
+        return valid
+
+    def read_last_ts(self, segment):
+        with open(os.path.join(self.path, segment[1]), "rb") as f:
+            f.seek(segment[2] - RECORD.size)
+            return RECORD.unpack(f.read(RECORD.size))[0]
+
+    def open_segment(self, start_ms):
+        name = "%016d%s" % (start_ms, SEGMENT_SUFFIX)
+        full = os.path.join(self.path, name)
+        self.fd = os.open(full, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if os.fstat(self.fd).st_size == 0:
+            os.write(self.fd, SEGMENT_HEADER.pack(SEGMENT_MAGIC, SEGMENT_VERSION, RECORD.size, start_ms))
+            self.fsync_dir()
+            self.segments.append([start_ms, name, SEGMENT_HEADER.size])
+
+    def fsync_dir(self):
+        dir_fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    def append(self, ts, value):
+        with self.lock:
+            # Keep timestamps ordered for binary search if the wall clock steps back
+            if self.last_ts is not None and ts < self.last_ts:
+                ts = self.last_ts
+            if self.fd is None or self.rotation_due(ts):
+                self.rotate(ts)
+            self.pending += pack_record(ts, value)
+            self.pending_count += 1
+            self.last_ts = ts
+            now = time.monotonic()
+            if self.pending_count >= self.flush_records or now - self.last_flush >= self.flush_interval_s:
+                self.flush_locked(now)
+
+    def rotation_due(self, ts):
+        start, _, size = self.segments[-1]
+        return (size + len(self.pending) >= self.segment_bytes
+                or ts - start >= self.segment_seconds * 1000)
+
+    def rotate(self, ts):
+        if self.fd is not None:
+            self.flush_locked(time.monotonic(), sync=True)
+            os.close(self.fd)
+            self.fd = None
+            self.stats["rotations"] += 1
+            self.open_segment(ts)
+        elif self.segments and not self.rotation_due(ts):
+            # First append after a restart resumes the newest segment while it is within bounds
+            name = self.segments[-1][1]
+            self.fd = os.open(os.path.join(self.path, name), os.O_WRONLY | os.O_APPEND)
+        else:
+            self.open_segment(ts)
+        self.apply_retention(ts)
+
+    def apply_retention(self, now_ms):
+        cutoff = now_ms - self.retention_seconds * 1000
+        total = sum(s[2] for s in self.segments)
+        # Never remove the segment being written
+        while len(self.segments) > 1:
+            next_start = self.segments[1][0]
+            if total <= self.retention_bytes and next_start > cutoff:
+                break
+            _, name, size = self.segments.pop(0)
+            os.remove(os.path.join(self.path, name))
+            total -= size
+            self.stats["removed"] += 1
+
+    def flush_locked(self, now, sync=False):
+        if self.pending:
+            os.write(self.fd, self.pending)
+            self.segments[-1][2] += len(self.pending)
+            self.pending = bytearray()
+            self.pending_count = 0
+            self.stats["flushes"] += 1
+        self.last_flush = now
+        if sync or now - self.last_fsync >= self.fsync_interval_s:
+            os.fsync(self.fd)
+            self.last_fsync = now
+            self.stats["fsyncs"] += 1
+
+    def flush(self, sync=True):
+        with self.lock:
+            if self.fd is not None:
+                self.flush_locked(time.monotonic(), sync=sync)
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                self.flush_locked(time.monotonic(), sync=True)
+                os.close(self.fd)
+                self.fd = None
+
+    def query(self, t_from, t_to):
+        # Samples with t_from <= ts < t_to as (timestamps int64, values int16)
+        with self.lock:
+            segments = [list(s) for s in self.segments]
+            pending = bytes(self.pending)
+        ts_parts = []
+        value_parts = []
+        for i, (start, name, size) in enumerate(segments):
+            end = segments[i + 1][0] if i + 1 < len(segments) else None
+            if start >= t_to or (end is not None and end <= t_from):
+                continue
+            if size <= SEGMENT_HEADER.size:
+                continue
+            with open(os.path.join(self.path, name), "rb") as f:
+                mm = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+            try:
+                records = np.frombuffer(mm, dtype=RECORD_DTYPE, offset=SEGMENT_HEADER.size,
+                                        count=(size - SEGMENT_HEADER.size) // RECORD.size)
+                self.select_into(records, t_from, t_to, ts_parts, value_parts)
+                del records
+            finally:
+                mm.close()
+        if pending:
+            records = np.frombuffer(pending, dtype=RECORD_DTYPE)
+            self.select_into(records, t_from, t_to, ts_parts, value_parts)
+        if not ts_parts:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int16)
+        return np.concatenate(ts_parts), np.concatenate(value_parts)
+
+    @staticmethod
+    def select_into(records, t_from, t_to, ts_parts, value_parts):
+        ts = records["ts"]
+        a = int(np.searchsorted(ts, t_from, "left"))
+        b = int(np.searchsorted(ts, t_to, "left"))
+        if b > a:
+            ts_parts.append(ts[a:b].astype(np.int64))
+            value_parts.append(records["value"][a:b].astype(np.int16))
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats,
+                        segments=len(self.segments),
+                        bytes=sum(s[2] for s in self.segments) + len(self.pending),
+                        oldest_ms=self.segments[0][0] if self.segments else None,
+                        pending_records=self.pending_count)
@@ -1,13 +1,19 @@
 import os
-import struct
-import smbus2
+import sys
+import threading
+import time
 from flask import Flask, jsonify, request, abort
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from i2c_bus import ChecksumError, RdwrTransfer, bus_manager, crc8
+
 # Environment variable configuration
 I2C_BUS = int(os.getenv('I2C_BUS', '1'))
 SI7021_I2C_ADDRESS = int(os.getenv('SI7021_I2C_ADDRESS', '0x40'), 16)
 SERVER_HOST = os.getenv('SERVER_HOST', '0.0.0.0')
 SERVER_PORT = int(os.getenv('SERVER_PORT', '8080'))
+SAMPLING_INTERVAL_MS = int(os.getenv('SAMPLING_INTERVAL_MS', '1000'))
+SAMPLE_MAX_AGE_MS = int(os.getenv('SAMPLE_MAX_AGE_MS', '5000'))  # older cached samples trigger a direct read
 
 # SI7021 Commands
 CMD_MEASURE_RH_HOLD = 0xE5
@@ -23,41 +29,164 @@ CMD_READ_HEATER_CTRL = 0x11
 CMD_READ_ID1 = [0xFA, 0x0F]
 CMD_READ_ID2 = [0xFC, 0xC9]
 CMD_READ_FWREV = [0x84, 0xB8]
+# Reply offsets of the CRC bytes in each electronic ID access
+ID1_CRC_OFFSETS = (1, 3, 5, 7)  # SNA_3, CRC, SNA_2, CRC, SNA_1, CRC, SNA_0, CRC
+ID2_CRC_OFFSETS = (2, 5)  # SNB_3, SNB_2, CRC, SNB_1, SNB_0, CRC
+
+# Worst-case conversion times (datasheet, 12-bit RH / 14-bit temp);
+# an RH conversion also runs a temperature conversion
+RH_CONVERSION_S = 0.023
+TEMP_CONVERSION_S = 0.011
+NO_HOLD_READ_RETRIES = 5
+
+# Latest sample published by the background sampler
+latest_sample = None
+sample_lock = threading.Lock()
+refresh_lock = threading.Lock()  # one request measures when the cached sample is stale
 
 app = Flask(__name__)
 
+# Held across multi-step sequences on this device (conversion waits, RH then
+# temperature-from-RH) so they do not interleave with each other; the bus
+# itself is only held for each individual transaction
+device_lock = threading.RLock()
+
+# Raw I2C_RDWR messages for this device: commands are at most 2 bytes,
+# replies at most 8 (first electronic ID access)
+transfer = RdwrTransfer(SI7021_I2C_ADDRESS, 2, 8)
+bus_manager.register(I2C_BUS, SI7021_I2C_ADDRESS)
+
 def get_i2c_bus():
-    return smbus2.SMBus(I2C_BUS)
+    return bus_manager.transaction(I2C_BUS)
+
+def checked_word(data):
+    # MSB, LSB, CRC-8 of both; a mismatch raises instead of returning a corrupt value
+    if crc8(data[:2]) != data[2]:
+        raise ChecksumError("Si7021 CRC mismatch: %02X%02X/%02X" % tuple(data))
+    return (data[0] << 8) | data[1]
+
+def checked_id(data, crc_offsets):
+    # Each CRC byte in an electronic ID reply covers all the ID bytes of that
+    # access before it
+    ident = []
+    for i, byte in enumerate(data):
+        if i not in crc_offsets:
+            ident.append(byte)
+        elif crc8(ident) != byte:
+            raise ChecksumError("Si7021 electronic ID CRC mismatch: %s" % bytes(data).hex().upper())
+    return data
+
+def read_hold(cmd):
+    # Command and 3-byte reply in one combined transaction; the device holds
+    # SCL low until the conversion is done. Takes device_lock like
+    # read_no_hold, so a measurement cannot slip between an RH conversion
+    # and the 0xE0 read of its temperature.
+    with device_lock:
+        with get_i2c_bus() as bus:
+            return checked_word(transfer.write_read(bus, [cmd], 3))
+
+def read_no_hold(cmd, conversion_s):
+    # Start the conversion, wait it out without clock stretching, then do a
+    # plain 3-byte read (re-sending the command would restart the conversion).
+    # The bus stays free for other devices during the wait.
+    with device_lock:
+        data = bus_manager.conversion(I2C_BUS, lambda bus: transfer.write(bus, [cmd]), conversion_s,
+                                      lambda bus: transfer.read(bus, 3), NO_HOLD_READ_RETRIES)
+        return checked_word(data)
+
+def use_hold(hold):
+    # Hold mode stretches SCL for the whole conversion (up to ~23 ms); on a
+    # bus shared with other devices the measurement is split instead
+    return hold and not bus_manager.shared(I2C_BUS)
 
 def measure_humidity(hold=True):
-    with get_i2c_bus() as bus:
-        cmd = CMD_MEASURE_RH_HOLD if hold else CMD_MEASURE_RH_NO_HOLD
-        bus.write_byte(SI7021_I2C_ADDRESS, cmd)
-        data = bus.read_i2c_block_data(SI7021_I2C_ADDRESS, cmd, 3)
-        raw = (data[0] << 8) | data[1]
-        humidity = ((125.0 * raw) / 65536.0) - 6.0
-        return round(humidity, 2)
+    if use_hold(hold):
+        raw = read_hold(CMD_MEASURE_RH_HOLD)
+    else:
+        raw = read_no_hold(CMD_MEASURE_RH_NO_HOLD, RH_CONVERSION_S)
+    humidity = ((125.0 * raw) / 65536.0) - 6.0
+    return round(humidity, 2)
 
 def measure_temperature(hold=True):
-    with get_i2c_bus() as bus:
-        cmd = CMD_MEASURE_TEMP_HOLD if hold else CMD_MEASURE_TEMP_NO_HOLD
-        bus.write_byte(SI7021_I2C_ADDRESS, cmd)
-        data = bus.read_i2c_block_data(SI7021_I2C_ADDRESS, cmd, 3)
-        raw = (data[0] << 8) | data[1]
-        temp = ((175.72 * raw) / 65536.0) - 46.85
-        return round(temp, 2)
+    if use_hold(hold):
+        raw = read_hold(CMD_MEASURE_TEMP_HOLD)
+    else:
+        raw = read_no_hold(CMD_MEASURE_TEMP_NO_HOLD, TEMP_CONVERSION_S)
+    temp = ((175.72 * raw) / 65536.0) - 46.85
+    return round(temp, 2)
 
 def read_temp_from_last_rh():
+    # 0xE0 replies with MSB and LSB only; the device sends no checksum for it
     with get_i2c_bus() as bus:
-        bus.write_byte(SI7021_I2C_ADDRESS, CMD_READ_TEMP_FROM_PREV_RH)
-        data = bus.read_i2c_block_data(SI7021_I2C_ADDRESS, CMD_READ_TEMP_FROM_PREV_RH, 3)
-        raw = (data[0] << 8) | data[1]
-        temp = ((175.72 * raw) / 65536.0) - 46.85
-        return round(temp, 2)
+        data = transfer.write_read(bus, [CMD_READ_TEMP_FROM_PREV_RH], 2)
+    raw = (data[0] << 8) | data[1]
+    temp = ((175.72 * raw) / 65536.0) - 46.85
+    return round(temp, 2)
+
+def measure_humidity_and_temperature(hold=True):
+    # RH conversion followed by the temperature from that same conversion,
+    # with no other command to this device in between
+    with device_lock:
+        humidity = measure_humidity(hold=hold)
+        temperature = read_temp_from_last_rh()
+    return humidity, temperature
+
+def sample_sensors(hold=False):
+    global latest_sample
+    humidity, temperature = measure_humidity_and_temperature(hold=hold)
+    sample = {
+        "humidity": humidity,
+        "temperature": temperature,
+        "timestamp": time.time(),
+        "monotonic": time.monotonic()
+    }
+    with sample_lock:
+        latest_sample = sample
+    return sample
+
+def sensor_sampling_loop():
+    while True:
+        try:
+            sample_sensors()
+        except Exception:
+            pass
+        time.sleep(SAMPLING_INTERVAL_MS / 1000.0)
+
+def get_sample(max_age_ms=None, hold=False):
+    # Cached sample when fresh enough, otherwise measure now (e.g. sampler not
+    # running). Only one request measures at a time; the others wait for it
+    # and take its sample, which is newer than their request.
+    if max_age_ms is None:
+        max_age_ms = SAMPLE_MAX_AGE_MS
+    requested = time.monotonic()
+
+    def usable(sample):
+        return sample is not None and (
+            sample["monotonic"] >= requested or (time.monotonic() - sample["monotonic"]) * 1000.0 <= max_age_ms)
+
+    with sample_lock:
+        sample = latest_sample
+    if usable(sample):
+        return sample
+    with refresh_lock:
+        with sample_lock:
+            sample = latest_sample
+        if usable(sample):
+            return sample
+        return sample_sensors(hold=hold)
+
+def request_max_age():
+    value = request.args.get('max_age_ms')
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, description="'max_age_ms' must be an integer")
 
 def reset_device():
     with get_i2c_bus() as bus:
-        bus.write_byte(SI7021_I2C_ADDRESS, CMD_RESET)
+        transfer.write(bus, [CMD_RESET])
 
 def read_user_register():
     with get_i2c_bus() as bus:
@@ -77,37 +206,82 @@ def write_heater_register(value):
     with get_i2c_bus() as bus:
         bus.write_byte_data(SI7021_I2C_ADDRESS, CMD_WRITE_HEATER_CTRL, value)
 
-def read_electronic_id():
+def read_id_bytes():
+    # Both electronic ID accesses, each one combined write+read, with every
+    # CRC checked like the measurement replies
     with get_i2c_bus() as bus:
-        bus.write_i2c_block_data(SI7021_I2C_ADDRESS, CMD_READ_ID1[0], [CMD_READ_ID1[1]])
-        id1 = bus.read_i2c_block_data(SI7021_I2C_ADDRESS, 0, 8)
-        bus.write_i2c_block_data(SI7021_I2C_ADDRESS, CMD_READ_ID2[0], [CMD_READ_ID2[1]])
-        id2 = bus.read_i2c_block_data(SI7021_I2C_ADDRESS, 0, 6)
-        eid = ''.join(['%02X' % b for b in id1[::2]]) + ''.join(['%02X' % b for b in id2[::2]])
-        return eid
+        id1 = transfer.write_read(bus, CMD_READ_ID1, 8)
+        id2 = transfer.write_read(bus, CMD_READ_ID2, 6)
+    return checked_id(id1, ID1_CRC_OFFSETS), checked_id(id2, ID2_CRC_OFFSETS)
+
+def read_electronic_id():
+    id1, id2 = read_id_bytes()
+    eid = ''.join(['%02X' % b for b in id1[::2]]) + ''.join(['%02X' % b for b in id2[::2]])
+    return eid
 
 def read_serial_number():
-    with get_i2c_bus() as bus:
-        bus.write_i2c_block_data(SI7021_I2C_ADDRESS, CMD_READ_ID1[0], [CMD_READ_ID1[1]])
-        id1 = bus.read_i2c_block_data(SI7021_I2C_ADDRESS, 0, 8)
-        bus.write_i2c_block_data(SI7021_I2C_ADDRESS, CMD_READ_ID2[0], [CMD_READ_ID2[1]])
-        id2 = bus.read_i2c_block_data(SI7021_I2C_ADDRESS, 0, 6)
-        sn = (
-            '{:02X}{:02X}{:02X}{:02X}{:02X}{:02X}{:02X}{:02X}'
-            .format(id1[0], id1[2], id1[4], id1[6], id2[0], id2[1], id2[3], id2[4])
-        )
-        return sn
+    id1, id2 = read_id_bytes()
+    sn = (
+        '{:02X}{:02X}{:02X}{:02X}{:02X}{:02X}{:02X}{:02X}'
+        .format(id1[0], id1[2], id1[4], id1[6], id2[0], id2[1], id2[3], id2[4])
+    )
+    return sn
 
 def read_firmware_revision():
     with get_i2c_bus() as bus:
-        bus.write_i2c_block_data(SI7021_I2C_ADDRESS, CMD_READ_FWREV[0], [CMD_READ_FWREV[1]])
-        rev = bus.read_byte(SI7021_I2C_ADDRESS)
-        if rev == 0xFF:
-            return "1.0"
-        elif rev == 0x20:
-            return "2.0"
-        else:
-            return "unknown"
+        rev = transfer.write_read(bus, CMD_READ_FWREV, 1)[0]
+    if rev == 0xFF:
+        return "1.0"
+    elif rev == 0x20:
+        return "2.0"
+    else:
+        return "unknown"
+
+# POST /batch operations, named after the GET routes they stand in for and
+# answered with the same JSON those routes return
+BATCH_SENSOR_OPS = {
+    'sensors/humidity': lambda sample: {'humidity': sample['humidity']},
+    'sensors/temperature': lambda sample: {'temperature': sample['temperature']},
+    'sensors/all': lambda sample: {
+        'humidity': sample['humidity'],
+        'temperature': sample['temperature'],
+        'timestamp': sample['timestamp']
+    },
+}
+BATCH_REGISTER_OPS = {
+    'info/sn': lambda: {'serial_number': read_serial_number()},
+    'info/eid': lambda: {'electronic_id': read_electronic_id()},
+    'info/fw': lambda: {'firmware_revision': read_firmware_revision()},
+    'register/user': lambda: {'user_register': read_user_register()},
+    'register/heater': lambda: {'heater_register': read_heater_register()},
+}
+
+def run_batch(ops, max_age_ms=None):
+    # Sensor values come first and share one sample: the cached one when fresh
+    # enough, otherwise a single RH conversion whose temperature is read back
+    # with 0xE0, so no second conversion is started. The sample is taken
+    # before the bus is acquired, so on a shared bus the conversion leaves it
+    # free for other devices. The register reads need no conversion and run
+    # under one bus acquisition.
+    results = {}
+    sample = None
+    if any(op in BATCH_SENSOR_OPS for op in ops):
+        try:
+            sample = get_sample(max_age_ms, hold=True)
+        except OSError as e:
+            sample = {'error': str(e)}
+    with device_lock, get_i2c_bus():
+        for op in ops:
+            if op in results:
+                continue
+            if op in BATCH_SENSOR_OPS:
+                results[op] = sample if 'error' in sample else BATCH_SENSOR_OPS[op](sample)
+                continue
+            try:
+                results[op] = BATCH_REGISTER_OPS[op]()
+            except OSError as e:
+                results[op] = {'error': str(e)}
+    return results
 
 @app.route('/info/sn', methods=['GET'])
 def api_get_serial_number():
@@ -162,13 +336,22 @@ def api_get_firmware_revision():
 
 @app.route('/sensors/humidity', methods=['GET'])
 def api_get_humidity():
-    humidity = measure_humidity(hold=True)
-    return jsonify({'humidity': humidity})
+    sample = get_sample(request_max_age())
+    return jsonify({'humidity': sample['humidity']})
 
 @app.route('/sensors/temperature', methods=['GET'])
 def api_get_temperature():
-    temperature = measure_temperature(hold=True)
-    return jsonify({'temperature': temperature})
+    sample = get_sample(request_max_age())
+    return jsonify({'temperature': sample['temperature']})
+
+@app.route('/sensors/all', methods=['GET'])
+def api_get_all_sensors():
+    sample = get_sample(request_max_age())
+    return jsonify({
+        'humidity': sample['humidity'],
+        'temperature': sample['temperature'],
+        'timestamp': sample['timestamp']
+    })
 
 @app.route('/commands/reset', methods=['POST'])
 def api_post_reset():
@@ -198,5 +381,30 @@ def api_post_measure():
         abort(400, description="Unknown measurement type")
     return jsonify(result)
 
+@app.route('/batch', methods=['POST'])
+def api_post_batch():
+    data = request.get_json(silent=True)
+    ops = data.get('ops') if isinstance(data, dict) else None
+    if not isinstance(ops, list) or not ops:
+        return jsonify({'error': "JSON body must have 'ops' field (non-empty list)"}), 400
+    if not all(isinstance(op, str) for op in ops):
+        return jsonify({'error': "'ops' entries must be strings"}), 400
+    unknown = [op for op in ops if op not in BATCH_SENSOR_OPS and op not in BATCH_REGISTER_OPS]
+    if unknown:
+        return jsonify({'error': "Unknown operations: %s" % ', '.join(unknown)}), 400
+    max_age_ms = data.get('max_age_ms')
+    if max_age_ms is not None and not isinstance(max_age_ms, int):
+        return jsonify({'error': "'max_age_ms' must be an integer"}), 400
+    return jsonify({'results': run_batch(ops, max_age_ms)})
+
+def start_sampler():
+    t = threading.Thread(target=sensor_sampling_loop, daemon=True)
+    t.start()
+
+def start():
+    # Background work, run once by __main__ or by the I2C gateway
+    start_sampler()
+
 if __name__ == '__main__':
+    start()
     app.run(host=SERVER_HOST, port=SERVER_PORT)
\ No newline at end of file
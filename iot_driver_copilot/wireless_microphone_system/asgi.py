@@ -0,0 +1,89 @@
+import asyncio
+import os
+import sys
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import driver
+
+# ASGI serving mode: /data/audio listeners run as coroutines woken by the
+# producer thread, so an idle listener holds a socket but no OS thread.
+# Every other route is the unchanged Flask app behind a small WSGI thread pool.
+# Run with `python asgi.py` or `uvicorn asgi:app`.
+WSGI_WORKERS = int(os.environ.get('WSGI_WORKERS', 8))
+
+class LoopNotifier:
+    # Bridges DeviceState listeners (producer thread) into one event loop
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def notify(self):
+        self.loop.call_soon_threadsafe(self.wake)
+
+    def wake(self):
+        future, self.future = self.future, self.loop.create_future()
+        future.set_result(None)
+
+    async def wait(self, future, timeout):
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+notifier = None
+
+def get_notifier():
+    global notifier
+    if notifier is None:
+        notifier = LoopNotifier(asyncio.get_running_loop())
+        driver.device_state.add_listener(notifier.notify)
+    return notifier
+
+async def data_audio(request):
+    try:
+        codec, framed = driver.negotiate_audio_format(request.query_params, request.headers.get("accept"))
+    except driver.NotAcceptable as e:
+        return JSONResponse({"error": str(e)}, status_code=406)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    wake = get_notifier()
+
+    async def generate():
+        subscriber = driver.device_state.audio_ring.subscribe(codec, framed)
+        try:
+            while True:
+                if not driver.device_state.streaming:
+                    await asyncio.sleep(0.1)
+                    continue
+                # Take the future before checking so a chunk published in between is not missed
+                future = wake.future
+                packets = subscriber.read(timeout=0)
+                if packets is None:
+                    if await wake.wait(future, 1):
+                        continue
+                    packets = subscriber.filler()
+                for packet in packets:
+                    yield packet
+        finally:
+            subscriber.close()
+
+    headers = {
+        "Cache-Control": "no-cache",
+        "Connection": "keep-alive"
+    }
+    return StreamingResponse(
+        generate(), headers=headers, media_type=driver.audio_content_type(codec, framed))
+
+app = Starlette(routes=[
+    Route('/data/audio', data_audio, methods=['GET']),
+    Mount('/', app=WSGIMiddleware(driver.app, workers=WSGI_WORKERS)),
+])
+
+if __name__ == '__main__':
+    uvicorn.run(app, host=driver.SERVER_HOST, port=driver.SERVER_PORT)
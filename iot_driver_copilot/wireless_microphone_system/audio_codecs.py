@@ -0,0 +1,159 @@
+import struct
+import numpy as np
+
+# Audio encodings offered on /data/audio. Everything here is pure
+# Python/NumPy so the driver needs no native codec libraries.
+#
+# ulaw:  G.711 mu-law, 8 bits per sample (2:1 against 16-bit PCM).
+# adpcm: IMA ADPCM, 4 bits per sample (4:1). Each chunk is one
+#        self-contained block so a listener can start or resume anywhere:
+#        for every channel a 4-byte header <h predictor, B step index, x>,
+#        then for every channel ceil(n/2) bytes of nibbles, first sample in
+#        the low nibble.
+#
+# Framed transport: every chunk is preceded by a 20-byte header
+#   <2s magic b"AF", B codec id, B flags, I sequence, Q timestamp_us, I payload length>
+# Sequence gaps show dropped chunks; FLAG_FILLER marks silence the server
+# inserted because no audio arrived in time.
+
+CODEC_IDS = {"pcm": 0, "ulaw": 1, "adpcm": 2}
+MEDIA_TYPES = {"pcm": "audio/L16", "ulaw": "audio/PCMU", "adpcm": "audio/x-ima-adpcm"}
+FRAMED_MEDIA_TYPE = "application/x-audio-frames"
+FRAME_HEADER = struct.Struct("<2sBBIQI")
+FRAME_MAGIC = b"AF"
+FLAG_FILLER = 0x01
+
+IMA_INDEX_TABLE = [-1, -1, -1, -1, 2, 4, 6, 8] * 2
+IMA_STEP_TABLE = [
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442, 11487,
+    12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794, 32767,
+]
+
+def to_int16(pcm, sample_width):
+    samples = np.frombuffer(pcm, dtype="<i2" if sample_width == 2 else "<i4")
+    if sample_width == 4:
+        samples = (samples >> 16).astype(np.int16)
+    return samples
+
+def encode_ulaw(samples):
+    # Vectorized G.711 mu-law (bias 0x84, clip 32635)
+    x = samples.astype(np.int32)
+    sign = np.where(x < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(x), 32635) + 0x84
+    exponent = np.floor(np.log2(magnitude)).astype(np.int32) - 7
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    return (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8).tobytes()
+
+def decode_ulaw(data):
+    u = ~np.frombuffer(data, dtype=np.uint8).astype(np.int32) & 0xFF
+    exponent = (u >> 4) & 0x07
+    magnitude = (((u & 0x0F) << 3) + 0x84 << exponent) - 0x84
+    return np.where(u & 0x80, -magnitude, magnitude).astype(np.int16)
+
+class AdpcmEncoder:
+    # Predictor and step index carry over between chunks for quality, and are
+    # written into each block header so every block also decodes on its own
+    def __init__(self, channels):
+        self.channels = channels
+        self.state = [(0, 0)] * channels
+
+    def encode(self, samples):
+        frames = samples.reshape(-1, self.channels)
+        headers = []
+        bodies = []
+        for ch in range(self.channels):
+            predictor, index = self.state[ch]
+            headers.append(struct.pack("<hBx", predictor, index))
+            nibbles, predictor, index = ima_encode(frames[:, ch].tolist(), predictor, index)
+            self.state[ch] = (predictor, index)
+            if len(nibbles) % 2:
+                nibbles.append(0)
+            bodies.append(bytes(lo | (hi << 4) for lo, hi in zip(nibbles[0::2], nibbles[1::2])))
+        return b"".join(headers) + b"".join(bodies)
+
+def ima_encode(samples, predictor, index):
+    step_table = IMA_STEP_TABLE
+    index_table = IMA_INDEX_TABLE
+    out = []
+    append = out.append
+    for sample in samples:
+        step = step_table[index]
+        diff = sample - predictor
+        nibble = 0
+        if diff < 0:
+            nibble = 8
+            diff = -diff
+        delta = step >> 3
+        if diff >= step:
+            nibble |= 4
+            diff -= step
+            delta += step
+        step >>= 1
+        if diff >= step:
+            nibble |= 2
+            diff -= step
+            delta += step
+        step >>= 1
+        if diff >= step:
+            nibble |= 1
+            delta += step
+        if nibble & 8:
+            predictor -= delta
+            if predictor < -32768:
+                predictor = -32768
+        else:
+            predictor += delta
+            if predictor > 32767:
+                predictor = 32767
+        index += index_table[nibble]
+        if index < 0:
+            index = 0
+        elif index > 88:
+            index = 88
+        append(nibble)
+    return out, predictor, index
+
+def decode_adpcm(block, channels, frames):
+    # Reference decoder for the block layout above; returns int16 interleaved samples
+    out = np.empty((frames, channels), dtype=np.int16)
+    body = 4 * channels
+    per_channel = (frames + 1) // 2
+    for ch in range(channels):
+        predictor, index = struct.unpack_from("<hBx", block, 4 * ch)
+        data = block[body + ch * per_channel:body + (ch + 1) * per_channel]
+        for i in range(frames):
+            nibble = (data[i // 2] >> (4 * (i % 2))) & 0x0F
+            step = IMA_STEP_TABLE[index]
+            delta = step >> 3
+            if nibble & 4:
+                delta += step
+            if nibble & 2:
+                delta += step >> 1
+            if nibble & 1:
+                delta += step >> 2
+            predictor = max(-32768, predictor - delta) if nibble & 8 else min(32767, predictor + delta)
+            index = min(88, max(0, index + IMA_INDEX_TABLE[nibble]))
+            out[i, ch] = predictor
+    return out.reshape(-1)
+
+class ChunkEncoder:
+    # One per codec with listeners; the producer runs every chunk through it once
+    def __init__(self, codec, sample_width, channels):
+        self.codec = codec
+        self.sample_width = sample_width
+        self.adpcm = AdpcmEncoder(channels) if codec == "adpcm" else None
+
+    def encode(self, pcm):
+        if self.codec == "pcm":
+            return pcm
+        samples = to_int16(pcm, self.sample_width)
+        if self.codec == "ulaw":
+            return encode_ulaw(samples)
+        return self.adpcm.encode(samples)
+
+def frame_header(codec, seq, timestamp_us, payload, flags=0):
+    return FRAME_HEADER.pack(FRAME_MAGIC, CODEC_IDS[codec], flags, seq & 0xFFFFFFFF, timestamp_us, len(payload))
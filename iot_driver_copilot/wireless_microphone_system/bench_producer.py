@@ -0,0 +1,36 @@
+import os
+import sys
+import time
+import numpy as np
+
+# Defaults to the 48 kHz stereo case; override via the driver's usual env vars
+os.environ.setdefault("AUDIO_SAMPLE_RATE", "48000")
+os.environ.setdefault("AUDIO_CHANNELS", "2")
+os.environ.setdefault("AUDIO_CHUNK_SIZE", str(48000 * 2 * 2 // 10))
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import driver
+
+BENCH_AUDIO_SECONDS = float(os.environ.get("BENCH_AUDIO_SECONDS", 60))
+
+def main():
+    tone = driver.ToneGenerator()
+    chunk_seconds = tone.frames / driver.AUDIO_SAMPLE_RATE
+    chunks = int(BENCH_AUDIO_SECONDS / chunk_seconds)
+    cpu0 = time.process_time()
+    previous = None
+    worst_step = 0
+    for _ in range(chunks):
+        data = np.frombuffer(tone.next_chunk(), dtype=driver.SAMPLE_DTYPES[driver.AUDIO_SAMPLE_WIDTH])
+        # Largest jump across a chunk boundary; a phase reset shows up here
+        if previous is not None:
+            worst_step = max(worst_step, abs(int(data[0]) - int(previous)))
+        previous = data[-driver.AUDIO_CHANNELS]
+    cpu = time.process_time() - cpu0
+    audio_seconds = chunks * chunk_seconds
+    print(f"{driver.AUDIO_SAMPLE_RATE} Hz x {driver.AUDIO_CHANNELS} ch, {chunks} chunks of {chunk_seconds * 1000:.0f} ms")
+    print(f"cpu {cpu * 1000:.1f} ms for {audio_seconds:.0f} s of audio = {cpu / audio_seconds * 100:.3f}% of one core")
+    print(f"largest sample step at a chunk boundary: {worst_step}")
+
+if __name__ == '__main__':
+    main()
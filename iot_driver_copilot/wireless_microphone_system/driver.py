@@ -1,7 +1,8 @@
 import os
 import threading
 import time
-import queue
+import numpy as np
+import audio_codecs
 from flask import Flask, Response, request, jsonify, stream_with_context
 
 app = Flask(__name__)
@@ -14,6 +15,182 @@ AUDIO_SAMPLE_RATE = int(os.environ.get("AUDIO_SAMPLE_RATE", "16000"))
 AUDIO_SAMPLE_WIDTH = int(os.environ.get("AUDIO_SAMPLE_WIDTH", "2"))  # 16-bit = 2 bytes
 AUDIO_CHANNELS = int(os.environ.get("AUDIO_CHANNELS", "1"))
 AUDIO_CHUNK_SIZE = int(os.environ.get("AUDIO_CHUNK_SIZE", str(AUDIO_SAMPLE_RATE * AUDIO_SAMPLE_WIDTH // 10)))  # 100ms
+AUDIO_TONE_FREQ = float(os.environ.get("AUDIO_TONE_FREQ", "440"))  # Hz, simulated signal
+AUDIO_RING_DEPTH = int(os.environ.get("AUDIO_RING_DEPTH", "50"))  # chunks a slow listener may lag before skipping
+
+SAMPLE_DTYPES = {2: "<i2", 4: "<i4"}
+if AUDIO_SAMPLE_WIDTH not in SAMPLE_DTYPES:
+    raise ValueError("AUDIO_SAMPLE_WIDTH must be one of: %s bytes (got %d)"
+                     % (", ".join(str(w) for w in sorted(SAMPLE_DTYPES)), AUDIO_SAMPLE_WIDTH))
+AUDIO_CHUNK_SECONDS = (AUDIO_CHUNK_SIZE // (AUDIO_SAMPLE_WIDTH * AUDIO_CHANNELS)) / AUDIO_SAMPLE_RATE
+MAX_CATCHUP_CHUNKS = 10  # further behind than this and the producer resyncs instead of bursting
+
+# --- Simulated signal source ---
+class ToneGenerator:
+    # Produces whole PCM chunks in one vectorized pass. The phase is carried
+    # across chunks so the tone has no discontinuity at chunk boundaries.
+    def __init__(self, freq=AUDIO_TONE_FREQ, amplitude=0.5):
+        self.frames = AUDIO_CHUNK_SIZE // (AUDIO_SAMPLE_WIDTH * AUDIO_CHANNELS)
+        self.step = 2 * np.pi * freq / AUDIO_SAMPLE_RATE
+        self.scale = amplitude * (2 ** (8 * AUDIO_SAMPLE_WIDTH - 1) - 1)
+        self.phase = 0.0
+        # Preallocated work buffers, reused for every chunk
+        self.ramp = np.arange(self.frames) * self.step
+        self.work = np.empty(self.frames)
+        self.samples = np.empty((self.frames, AUDIO_CHANNELS), dtype=SAMPLE_DTYPES[AUDIO_SAMPLE_WIDTH])
+
+    def next_chunk(self):
+        np.add(self.ramp, self.phase, out=self.work)
+        np.sin(self.work, out=self.work)
+        self.work *= self.scale
+        self.samples[:] = self.work[:, None]
+        self.phase = (self.phase + self.step * self.frames) % (2 * np.pi)
+        return self.samples.tobytes()
+
+# --- Broadcast ring: each chunk is stored once, every listener reads with its own cursor ---
+class AudioRing:
+    # Slots hold (timestamp_us, {codec: payload}); the producer encodes each chunk
+    # once for every codec that currently has listeners
+    def __init__(self, depth=AUDIO_RING_DEPTH):
+        self.depth = depth
+        self.slots = [None] * depth
+        self.head = 0  # sequence number of the next chunk to be written
+        self.subscribers = 0
+        self.codec_subscribers = {}
+        self.encoders = {}
+        self.silence = {}
+        self.chunks_skipped = 0
+        self.cond = threading.Condition()
+
+    def publish(self, chunk):
+        timestamp_us = int(time.time() * 1000000)
+        with self.cond:
+            encoders = list(self.encoders.values())
+        # Encode outside the lock; the producer is the only writer
+        encoded = {"pcm": chunk}
+        for encoder in encoders:
+            encoded[encoder.codec] = encoder.encode(chunk)
+        with self.cond:
+            self.slots[self.head % self.depth] = (timestamp_us, encoded)
+            self.head += 1
+            self.cond.notify_all()
+
+    def subscribe(self, codec="pcm", framed=False):
+        with self.cond:
+            self.subscribers += 1
+            self.codec_subscribers[codec] = self.codec_subscribers.get(codec, 0) + 1
+            if codec != "pcm" and codec not in self.encoders:
+                self.encoders[codec] = audio_codecs.ChunkEncoder(codec, AUDIO_SAMPLE_WIDTH, AUDIO_CHANNELS)
+            return RingSubscriber(self, self.head, codec, framed)
+
+    def unsubscribe(self, codec):
+        with self.cond:
+            self.subscribers -= 1
+            self.codec_subscribers[codec] -= 1
+            if self.codec_subscribers[codec] == 0:
+                del self.codec_subscribers[codec]
+                self.encoders.pop(codec, None)
+
+    def silence_for(self, codec):
+        with self.cond:
+            payload = self.silence.get(codec)
+        if payload is None:
+            encoder = audio_codecs.ChunkEncoder(codec, AUDIO_SAMPLE_WIDTH, AUDIO_CHANNELS)
+            payload = encoder.encode(bytes(AUDIO_CHUNK_SIZE))
+            with self.cond:
+                self.silence[codec] = payload
+        return payload
+
+    def get_stats(self):
+        with self.cond:
+            return {
+                "subscribers": self.subscribers,
+                "codecs": dict(self.codec_subscribers),
+                "chunks_published": self.head,
+                "chunks_skipped": self.chunks_skipped,
+                "ring_depth": self.depth,
+            }
+
+class RingSubscriber:
+    def __init__(self, ring, seq, codec="pcm", framed=False):
+        self.ring = ring
+        self.seq = seq
+        self.codec = codec
+        self.framed = framed
+        self.skipped = 0
+
+    def read(self, timeout=None):
+        # Packets for the next chunk on this cursor, or None if nothing arrives
+        # within timeout. A cursor overrun by the producer jumps to the oldest
+        # chunk still held.
+        ring = self.ring
+        with ring.cond:
+            if not ring.cond.wait_for(lambda: ring.head > self.seq, timeout):
+                return None
+            lag = ring.head - self.seq
+            if lag > ring.depth:
+                skipped = lag - ring.depth
+                self.skipped += skipped
+                ring.chunks_skipped += skipped
+                self.seq = ring.head - ring.depth
+            seq = self.seq
+            timestamp_us, encoded = ring.slots[seq % ring.depth]
+            self.seq += 1
+            payload = encoded.get(self.codec)
+        if payload is None:
+            # Subscribed after the producer picked its encoders for this chunk
+            encoder = audio_codecs.ChunkEncoder(self.codec, AUDIO_SAMPLE_WIDTH, AUDIO_CHANNELS)
+            payload = encoded.setdefault(self.codec, encoder.encode(encoded["pcm"]))
+        return self.packets(seq, timestamp_us, payload)
+
+    def filler(self):
+        # Silence sent when the producer is late, flagged so framed clients can tell
+        payload = self.ring.silence_for(self.codec)
+        return self.packets(self.seq, int(time.time() * 1000000), payload, audio_codecs.FLAG_FILLER)
+
+    def packets(self, seq, timestamp_us, payload, flags=0):
+        if not self.framed:
+            return [payload]
+        return [audio_codecs.frame_header(self.codec, seq, timestamp_us, payload, flags), payload]
+
+    def close(self):
+        self.ring.unsubscribe(self.codec)
+
+class NotAcceptable(ValueError):
+    # Accept allows none of the stream's media types (406, not a bad request)
+    pass
+
+def negotiate_audio_format(args, accept):
+    # Query parameters win; otherwise the earliest matching media type in
+    # Accept. A bad query parameter raises ValueError, an Accept header that
+    # allows nothing the stream can be sent as raises NotAcceptable.
+    accept = (accept or "").lower()
+    codec = args.get("codec")
+    if codec is None:
+        best = len(accept)
+        for name, media_type in audio_codecs.MEDIA_TYPES.items():
+            pos = accept.find(media_type.lower())
+            if pos != -1 and pos < best:
+                codec, best = name, pos
+        if codec is None:
+            if accept.strip() and not any(t in accept for t in ("*/*", "audio/*", audio_codecs.FRAMED_MEDIA_TYPE)):
+                raise NotAcceptable("Accept must allow one of: " + ", ".join(
+                    list(audio_codecs.MEDIA_TYPES.values()) + [audio_codecs.FRAMED_MEDIA_TYPE]))
+            codec = "pcm"
+    framing = args.get("framing")
+    if framing is None:
+        framing = "framed" if audio_codecs.FRAMED_MEDIA_TYPE in accept else "raw"
+    if codec not in audio_codecs.CODEC_IDS:
+        raise ValueError("codec must be one of: " + ", ".join(audio_codecs.CODEC_IDS))
+    if framing not in ("raw", "framed"):
+        raise ValueError("framing must be 'raw' or 'framed'")
+    return codec, framing == "framed"
+
+def audio_content_type(codec, framed):
+    params = "rate={}; channels={}".format(AUDIO_SAMPLE_RATE, AUDIO_CHANNELS)
+    if framed:
+        return "{}; codec={}; {}".format(audio_codecs.FRAMED_MEDIA_TYPE, codec, params)
+    return "{}; {}".format(audio_codecs.MEDIA_TYPES[codec], params)
 
 # --- Device State Simulation/Abstraction (replace with hardware access in real use) ---
 class DeviceState:
@@ -27,13 +204,21 @@ class DeviceState:
         self.led_status = "green"
         self.rf_channel = 1
         self.crc_result = "OK"
-        self.audio_queue = queue.Queue(maxsize=50)
+        self.audio_ring = AudioRing()
+        self.tone = ToneGenerator()
+        # bytes are immutable, so one silence chunk can be handed out everywhere
+        self.silence = bytes(AUDIO_CHUNK_SIZE)
         self.lock = threading.Lock()
+        # Set while streaming so the producer can park instead of polling
+        self.stream_event = threading.Event()
+        # Extra callbacks run by the producer after each chunk (used by the ASGI server)
+        self.listeners = []
 
     def init_device(self):
         with self.lock:
             self.initialized = True
             self.streaming = False
+            self.stream_event.clear()
             self.muted = False
             self.frequency = 2405
             self.hopping_enabled = False
@@ -45,8 +230,10 @@ class DeviceState:
         with self.lock:
             if action == "start":
                 self.streaming = True
+                self.stream_event.set()
             elif action == "stop":
                 self.streaming = False
+                self.stream_event.clear()
         return True
 
     def set_frequency(self, frequency, hopping_enabled):
@@ -60,6 +247,16 @@ class DeviceState:
             self.muted = mute
         return True
 
+    def add_listener(self, callback):
+        with self.lock:
+            self.listeners.append(callback)
+
+    def notify_listeners(self):
+        with self.lock:
+            listeners = list(self.listeners)
+        for listener in listeners:
+            listener()
+
     def get_status(self):
         with self.lock:
             return {
@@ -77,34 +274,91 @@ class DeviceState:
         try:
             # Simulate PCM audio samples: silence or muted signal
             if not self.streaming or self.muted:
-                data = bytes([0] * AUDIO_CHUNK_SIZE)
-            else:
-                # Simulate simple sine wave or random data for demonstration
-                import math
-                import struct
-                samples = []
-                t = time.time()
-                freq = 440  # Hz
-                for i in range(AUDIO_CHUNK_SIZE // AUDIO_SAMPLE_WIDTH):
-                    value = int(32767 * 0.5 * math.sin(2 * math.pi * freq * (t + i / AUDIO_SAMPLE_RATE)))
-                    samples.append(struct.pack('<h', value))
-                data = b''.join(samples)
-            return data
+                return self.silence
+            return self.tone.next_chunk()
         except Exception:
-            return bytes([0] * AUDIO_CHUNK_SIZE)
+            return self.silence
 
 device_state = DeviceState()
 
 # --- Background Audio Producer Thread for Streaming ---
-def audio_producer():
-    while True:
-        if device_state.streaming:
-            chunk = device_state.get_audio_chunk()
-            if not device_state.audio_queue.full():
-                device_state.audio_queue.put(chunk)
-        time.sleep(AUDIO_CHUNK_SIZE / (AUDIO_SAMPLE_RATE * AUDIO_SAMPLE_WIDTH))
-
-producer_thread = threading.Thread(target=audio_producer, daemon=True)
+class AudioProducer:
+    # Publishes one chunk per AUDIO_CHUNK_SECONDS against absolute monotonic
+    # deadlines, so generation time never accumulates into drift.
+    # clock/sleep are injectable for the simulated-clock soak run.
+    def __init__(self, state, clock=time.monotonic, sleep=time.sleep):
+        self.state = state
+        self.clock = clock
+        self.sleep = sleep
+        self.period = AUDIO_CHUNK_SECONDS
+        self.lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {
+                "period_ms": round(self.period * 1000.0, 3),
+                "chunks": 0,
+                "produce_ms_last": 0.0,
+                "produce_ms_max": 0.0,
+                "produce_ms_avg": 0.0,
+                "jitter_ms_last": 0.0,
+                "jitter_ms_max": 0.0,
+                "jitter_ms_avg": 0.0,
+                "overruns": 0,   # producing a chunk took longer than its period
+                "underruns": 0,  # a chunk went out more than one period late
+                "resyncs": 0,    # fell too far behind and restarted the schedule
+            }
+
+    def run(self):
+        while True:
+            self.state.stream_event.wait()
+            self.stream(lambda: self.state.streaming)
+
+    def stream(self, keep_going):
+        deadline = self.clock()
+        while keep_going():
+            # Lateness of this wake-up against its scheduled deadline
+            started = self.clock()
+            jitter = started - deadline
+            chunk = self.state.get_audio_chunk()
+            self.state.audio_ring.publish(chunk)
+            self.state.notify_listeners()
+            produce_time = self.clock() - started
+            self.record(produce_time, jitter)
+            deadline += self.period
+            delay = deadline - self.clock()
+            if delay > 0:
+                self.sleep(delay)
+            elif -delay > MAX_CATCHUP_CHUNKS * self.period:
+                with self.lock:
+                    self.stats["resyncs"] += 1
+                deadline = self.clock()
+            # Otherwise produce immediately to catch up on the missed slots
+
+    def record(self, produce_time, jitter):
+        with self.lock:
+            stats = self.stats
+            stats["chunks"] += 1
+            produce_ms = produce_time * 1000.0
+            jitter_ms = max(0.0, jitter) * 1000.0
+            stats["produce_ms_last"] = round(produce_ms, 3)
+            stats["produce_ms_max"] = round(max(stats["produce_ms_max"], produce_ms), 3)
+            stats["produce_ms_avg"] = round(0.99 * stats["produce_ms_avg"] + 0.01 * produce_ms, 3)
+            stats["jitter_ms_last"] = round(jitter_ms, 3)
+            stats["jitter_ms_max"] = round(max(stats["jitter_ms_max"], jitter_ms), 3)
+            stats["jitter_ms_avg"] = round(0.99 * stats["jitter_ms_avg"] + 0.01 * jitter_ms, 3)
+            if produce_time > self.period:
+                stats["overruns"] += 1
+            if jitter > self.period:
+                stats["underruns"] += 1
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+audio_producer = AudioProducer(device_state)
+producer_thread = threading.Thread(target=audio_producer.run, daemon=True)
 producer_thread.start()
 
 # --- API Endpoints ---
@@ -150,23 +404,36 @@ def cmd_mute():
 @app.route("/data/status", methods=["GET"])
 def data_status():
     status = device_state.get_status()
+    status["audio"] = device_state.audio_ring.get_stats()
+    status["producer"] = audio_producer.get_stats()
     return jsonify(status), 200
 
 @app.route("/data/audio", methods=["GET"])
 def data_audio():
+    try:
+        codec, framed = negotiate_audio_format(request.args, request.headers.get("Accept"))
+    except NotAcceptable as e:
+        return jsonify({"error": str(e)}), 406
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     def generate():
-        # HTTP streaming: send PCM chunks as binary
-        while True:
-            if not device_state.streaming:
-                time.sleep(0.1)
-                continue
-            try:
-                chunk = device_state.audio_queue.get(timeout=1)
-            except queue.Empty:
-                chunk = bytes([0] * AUDIO_CHUNK_SIZE)
-            yield chunk
+        # HTTP streaming: send encoded chunks as binary, optionally framed
+        subscriber = device_state.audio_ring.subscribe(codec, framed)
+        try:
+            while True:
+                if not device_state.streaming:
+                    time.sleep(0.1)
+                    continue
+                packets = subscriber.read(timeout=1)
+                if packets is None:
+                    packets = subscriber.filler()
+                for packet in packets:
+                    yield packet
+        finally:
+            subscriber.close()
     headers = {
-        "Content-Type": "audio/L16; rate={}; channels={}".format(AUDIO_SAMPLE_RATE, AUDIO_CHANNELS),
+        "Content-Type": audio_content_type(codec, framed),
         "Transfer-Encoding": "chunked",
         "Cache-Control": "no-cache",
         "Connection": "keep-alive"
@@ -0,0 +1,75 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import driver
+
+# Runs AudioProducer for many simulated hours against a fake clock in a few
+# seconds of wall time, with randomised generation time, oversleep and the
+# occasional stall, then checks that the stream did not drift. The injected
+# stalls stay within MAX_CATCHUP_CHUNKS, so a healthy producer catches up
+# without resyncing; more than SOAK_MAX_RESYNCS resyncs fails the run.
+SOAK_HOURS = float(os.environ.get("SOAK_HOURS", 24))
+SOAK_SEED = int(os.environ.get("SOAK_SEED", 1))
+SOAK_STALL_EVERY = int(os.environ.get("SOAK_STALL_EVERY", 5000))  # chunks between injected stalls
+SOAK_MAX_RESYNCS = int(os.environ.get("SOAK_MAX_RESYNCS", 0))
+
+class SimulatedClock:
+    def __init__(self, rng):
+        self.now = 1000.0
+        self.rng = rng
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        # The scheduler wakes us a little late, never early
+        self.now += seconds + self.rng.uniform(0, 0.002)
+
+def main():
+    rng = random.Random(SOAK_SEED)
+    clock = SimulatedClock(rng)
+    state = driver.DeviceState()
+    state.set_streaming("start")
+    period = driver.AUDIO_CHUNK_SECONDS
+    chunks = [0]
+
+    def get_audio_chunk():
+        # Simulated generation cost, with a stall longer than several periods now and
+        # then; the last simulated minute is stall-free so the final check sees the
+        # producer caught up rather than mid-recovery
+        chunks[0] += 1
+        if chunks[0] % SOAK_STALL_EVERY == 0 and clock.now < end - 60:
+            clock.now += period * rng.uniform(1.5, 5)
+        else:
+            clock.now += rng.uniform(0.0002, 0.003)
+        return state.silence
+
+    start = clock.now
+    end = start + SOAK_HOURS * 3600
+    state.get_audio_chunk = get_audio_chunk
+    producer = driver.AudioProducer(state, clock=clock.time, sleep=clock.sleep)
+    producer.stream(lambda: clock.now < end)
+
+    elapsed = clock.now - start
+    stats = producer.get_stats()
+    expected = elapsed / period
+    drift_s = stats["chunks"] * period - elapsed
+    print(f"simulated {elapsed / 3600:.2f} h, period {period * 1000:.1f} ms")
+    print(f"chunks {stats['chunks']} expected {expected:.1f} drift {drift_s * 1000:+.1f} ms")
+    print({k: v for k, v in stats.items() if k != "chunks"})
+    failures = []
+    # A resync abandons the missed slots, so it shows up here as drift too
+    if abs(drift_s) > period:
+        failures.append("producer drifted by more than one period")
+    if stats["resyncs"] > SOAK_MAX_RESYNCS:
+        failures.append(f"{stats['resyncs']} resyncs (max {SOAK_MAX_RESYNCS})")
+    for failure in failures:
+        print("FAIL:", failure)
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+import hashlib
+import importlib
+import io
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from PIL import Image
+
+# Image-to-image jobs for the demo page. Uploads go into a bounded queue;
+# worker threads take up to max_batch queued images, waiting at most
+# max_wait_s for the batch to fill, and run them through the model in one
+# call. Inputs and results live in an ArtifactStore: an input is named
+# temp/temp_input_<sha256>.<ext> and its result outputs/<sha256(input +
+# model version)>_output.png, so a repeated upload is answered from the
+# store without queueing, and an upload identical to one still in the queue
+# joins that job.
+#
+# The model is any object with a `version` string and run(images) -> images
+# taking and returning lists of PIL images; an optional load() is called
+# once in the first worker before it takes jobs. load_model() builds it from
+# a "module:callable" spec, or the diffusers img2img pipeline on CPU when
+# the spec is "diffusers".
+
+INPUT_FORMATS = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp"}
+MAX_UPLOAD_PIXELS = 4096 * 4096
+
+class QueueFull(Exception):
+    pass
+
+class ModelUnavailable(Exception):
+    pass
+
+class Job:
+    def __init__(self, job_id, key, input_name, output_name, status):
+        self.id = job_id
+        self.key = key
+        self.input_name = input_name  # store names, relative to the static root
+        self.output_name = output_name
+        self.input_sha = None
+        self.status = status  # queued, running, done, failed
+        self.error = None
+        self.cached = status == "done"
+        self.batch_size = None
+        self.submitted = time.time()
+        self.finished = self.submitted if self.cached else None
+
+class Img2ImgModel:
+    # Stable Diffusion img2img from diffusers, float32 on CPU. The seed is
+    # fixed so one input always gives the same output, which is what makes
+    # results cacheable; every setting that changes the output is part of
+    # the version.
+    def __init__(self, model_id, prompt, strength=0.6, guidance_scale=7.5, steps=25, size=512, seed=0):
+        self.model_id = model_id
+        self.prompt = prompt
+        self.strength = strength
+        self.guidance_scale = guidance_scale
+        self.steps = steps
+        self.size = size
+        self.seed = seed
+        self.pipe = None
+        settings = "|".join(str(v) for v in (model_id, prompt, strength, guidance_scale, steps, size, seed))
+        self.version = "img2img-" + hashlib.sha256(settings.encode()).hexdigest()[:16]
+
+    def load(self):
+        import torch
+        from diffusers import StableDiffusionImg2ImgPipeline
+        self.torch = torch
+        self.pipe = StableDiffusionImg2ImgPipeline.from_pretrained(self.model_id, torch_dtype=torch.float32)
+        self.pipe = self.pipe.to("cpu")
+        self.pipe.set_progress_bar_config(disable=True)
+
+    def run(self, images):
+        images = [im.convert("RGB").resize((self.size, self.size), Image.LANCZOS) for im in images]
+        # One generator per image keeps each output independent of its batch
+        generators = [self.torch.Generator("cpu").manual_seed(self.seed) for _ in images]
+        with self.torch.inference_mode():
+            result = self.pipe(prompt=[self.prompt] * len(images), image=images, strength=self.strength,
+                               guidance_scale=self.guidance_scale, num_inference_steps=self.steps,
+                               generator=generators)
+        return result.images
+
+def load_model(spec, **settings):
+    if spec == "diffusers":
+        return Img2ImgModel(**settings)
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr or "create_model")()
+
+def sniff_image(data):
+    # File extension for an accepted upload; ValueError for anything else
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            if im.format not in INPUT_FORMATS:
+                raise ValueError("unsupported image format %s" % im.format)
+            if im.width * im.height > MAX_UPLOAD_PIXELS:
+                raise ValueError("image too large")
+            im.verify()
+            return INPUT_FORMATS[im.format]
+    except (OSError, SyntaxError) as e:
+        raise ValueError("not an image: %s" % e)
+
+class JobQueue:
+    def __init__(self, model, store, max_queue=32, max_batch=4, max_wait_s=0.05, workers=1, history=1000):
+        self.model = model
+        self.store = store
+        self.max_batch = max_batch
+        self.max_wait_s = max_wait_s
+        self.workers = workers
+        self.history = history
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.lock = threading.Lock()
+        self.changed = threading.Condition(self.lock)
+        self.jobs = OrderedDict()  # job id -> Job, oldest first
+        self.inflight = {}  # result key -> queued or running Job
+        self.ready = threading.Event()
+        self.load_error = None
+        self.threads = []
+        self.start_lock = threading.Lock()
+        self.stats = {"submitted": 0, "cache_hits": 0, "joined": 0, "rejected": 0, "failed": 0,
+                      "batches": 0, "images": 0, "run_s_total": 0.0, "batch_sizes": {}}
+
+    def start(self):
+        # Idempotent, so the web layer can start the pool on first use
+        with self.start_lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self.worker, args=(i == 0,), daemon=True, name="job-worker-%d" % i)
+                t.start()
+                self.threads.append(t)
+
+    def result_key(self, data):
+        h = hashlib.sha256(data)
+        h.update(b"\0" + self.model.version.encode())
+        return h.hexdigest()
+
+    def output_name(self, key):
+        return "outputs/%s_output.png" % key
+
+    def remember(self, job):
+        # Caller holds self.lock
+        self.jobs[job.id] = job
+        while len(self.jobs) > self.history:
+            oldest = next(iter(self.jobs.values()))
+            if oldest.status not in ("done", "failed"):
+                break
+            self.jobs.popitem(last=False)
+
+    def submit(self, data):
+        # Returns the Job for an upload: a finished one on a cache hit, the
+        # pending one for an identical queued upload, else a new queued job
+        ext = sniff_image(data)
+        key = self.result_key(data)
+        output = self.output_name(key)
+        input_name = "temp/temp_input_%s.%s" % (hashlib.sha256(data).hexdigest(), ext)
+        with self.lock:
+            self.stats["submitted"] += 1
+            job = self.inflight.get(key)
+            if job is not None:
+                self.stats["joined"] += 1
+                return job
+            if self.store.lookup(output) is not None:
+                self.stats["cache_hits"] += 1
+                job = Job(uuid.uuid4().hex, key, input_name, output, "done")
+                self.remember(job)
+                return job
+        # Held until the job finishes so eviction cannot take it from the queue
+        input_sha = self.store.put(input_name, data)
+        self.store.hold(input_sha)
+        with self.lock:
+            job = self.inflight.get(key)
+            if job is not None:
+                self.store.release(input_sha)
+                self.stats["joined"] += 1
+                return job
+            # Checked under the lock: a failed load drains the queue after
+            # setting load_error under it, so nothing is left queued forever
+            if self.load_error is not None:
+                self.store.release(input_sha)
+                raise ModelUnavailable(self.load_error)
+            job = Job(uuid.uuid4().hex, key, input_name, output, "queued")
+            job.input_sha = input_sha
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                self.store.release(input_sha)
+                self.stats["rejected"] += 1
+                raise QueueFull()
+            self.inflight[key] = job
+            self.remember(job)
+            return job
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def wait(self, job, timeout):
+        deadline = time.monotonic() + timeout
+        with self.changed:
+            while job.status in ("queued", "running"):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.changed.wait(remaining)
+        return job
+
+    def next_batch(self):
+        # Block for one job, then take more until the batch is full or
+        # max_wait_s has passed since the first one arrived
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait_s
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def worker(self, loads_model):
+        if loads_model:
+            try:
+                if hasattr(self.model, "load"):
+                    self.model.load()
+            except Exception as e:
+                with self.lock:
+                    self.load_error = "model failed to load: %s" % e
+                self.drain(self.load_error)
+                return
+            finally:
+                self.ready.set()
+        self.ready.wait()
+        if self.load_error is not None:
+            return
+        while True:
+            self.run_batch(self.next_batch())
+
+    def drain(self, error):
+        # Fail everything queued when there is no model to run it
+        while True:
+            try:
+                job = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            self.finish([job], error)
+
+    def run_batch(self, batch):
+        with self.lock:
+            for job in batch:
+                job.status = "running"
+                job.batch_size = len(batch)
+        t0 = time.monotonic()
+        try:
+            images = []
+            for job in batch:
+                with Image.open(self.store.path(job.input_name)) as im:
+                    images.append(im.convert("RGB"))
+            outputs = self.model.run(images)
+            for job, out in zip(batch, outputs):
+                buf = io.BytesIO()
+                out.save(buf, "PNG")
+                self.store.put(job.output_name, buf.getvalue())
+        except Exception as e:
+            self.finish(batch, "inference failed: %s" % e)
+            return
+        elapsed = time.monotonic() - t0
+        with self.lock:
+            self.stats["batches"] += 1
+            self.stats["images"] += len(batch)
+            self.stats["run_s_total"] += elapsed
+            sizes = self.stats["batch_sizes"]
+            sizes[len(batch)] = sizes.get(len(batch), 0) + 1
+        self.finish(batch)
+
+    def finish(self, batch, error=None):
+        with self.changed:
+            for job in batch:
+                job.status = "failed" if error else "done"
+                job.error = error
+                job.finished = time.time()
+                self.inflight.pop(job.key, None)
+                if job.input_sha is not None:
+                    self.store.release(job.input_sha)
+                    job.input_sha = None
+                if error:
+                    self.stats["failed"] += 1
+            self.changed.notify_all()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats, batch_sizes=dict(self.stats["batch_sizes"]))
+            stats["queued"] = self.queue.qsize()
+            stats["inflight"] = len(self.inflight)
+        stats["model_version"] = self.model.version
+        stats["model_ready"] = self.ready.is_set() and self.load_error is None
+        stats["model_error"] = self.load_error
+        stats["max_batch"] = self.max_batch
+        stats["max_wait_ms"] = self.max_wait_s * 1000.0
+        if stats["images"]:
+            stats["ms_per_image"] = stats["run_s_total"] * 1000.0 / stats["images"]
+        return stats
@@ -1,10 +1,220 @@
-from flask import Flask, render_template
+import hashlib
+import os
+from flask import Flask, render_template, request, abort, url_for, g, jsonify
+from werkzeug.utils import safe_join
+from image_cache import ImageVariantCache, FORMATS, WIDTH_BUCKETS
+from artifact_store import ArtifactStore
+from jobs import JobQueue, QueueFull, ModelUnavailable, load_model
+from static_assets import StaticAssets, compressed_bodies, respond, serve_asset, IMMUTABLE, REVALIDATE
 
-app = Flask(__name__,static_folder='static')
+IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR', 'cache/images')  # relative to the app directory
+IMAGE_CACHE_MB = float(os.environ.get('IMAGE_CACHE_MB', '200'))
+IMAGE_QUALITY = int(os.environ.get('IMAGE_QUALITY', '80'))
+IMAGE_DEFAULT_WIDTH = int(os.environ.get('IMAGE_DEFAULT_WIDTH', '640'))
+
+# /jobs: JOB_MODEL is "diffusers" (img2img on CPU, JOB_MODEL_ID and the
+# JOB_* generation settings) or "module:callable" returning a model object
+JOB_MODEL = os.environ.get('JOB_MODEL', 'diffusers')
+JOB_MODEL_ID = os.environ.get('JOB_MODEL_ID', 'stable-diffusion-v1-5/stable-diffusion-v1-5')
+JOB_PROMPT = os.environ.get('JOB_PROMPT', 'a dreamy watercolor illustration, soft golden light, delicate brushstrokes')
+JOB_STRENGTH = float(os.environ.get('JOB_STRENGTH', '0.6'))
+JOB_GUIDANCE_SCALE = float(os.environ.get('JOB_GUIDANCE_SCALE', '7.5'))
+JOB_STEPS = int(os.environ.get('JOB_STEPS', '25'))
+JOB_SIZE = int(os.environ.get('JOB_SIZE', '512'))
+JOB_SEED = int(os.environ.get('JOB_SEED', '0'))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', '32'))
+JOB_MAX_BATCH = int(os.environ.get('JOB_MAX_BATCH', '4'))
+JOB_MAX_WAIT_MS = float(os.environ.get('JOB_MAX_WAIT_MS', '50'))
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '1'))
+JOB_MAX_UPLOAD_MB = float(os.environ.get('JOB_MAX_UPLOAD_MB', '10'))
+JOB_MAX_WAIT_S = 30.0  # longest ?wait= a request may block for
+
+# Job inputs (static/temp) and outputs (static/outputs) are hard links into a
+# content-addressed store, bounded by size and idle age
+ARTIFACT_STORE_DIR = os.environ.get('ARTIFACT_STORE_DIR', 'store')  # relative to the app directory
+ARTIFACT_MAX_MB = float(os.environ.get('ARTIFACT_MAX_MB', '512'))
+ARTIFACT_MAX_AGE_DAYS = float(os.environ.get('ARTIFACT_MAX_AGE_DAYS', '7'))
+
+# static/ is served by serve_static below (content-hash ETags, precompressed bodies)
+app = Flask(__name__, static_folder=None)
+STATIC_ROOT = os.path.join(app.root_path, 'static')
+artifact_store = ArtifactStore(STATIC_ROOT, os.path.join(app.root_path, ARTIFACT_STORE_DIR),
+                               int(ARTIFACT_MAX_MB * (1 << 20)), ARTIFACT_MAX_AGE_DAYS * 86400)
+static_assets = StaticAssets(STATIC_ROOT)
+image_cache = ImageVariantCache(os.path.join(app.root_path, IMAGE_CACHE_DIR), int(IMAGE_CACHE_MB * (1 << 20)),
+                                IMAGE_QUALITY)
+app.config['MAX_CONTENT_LENGTH'] = int(JOB_MAX_UPLOAD_MB * (1 << 20))
+
+if JOB_MODEL == 'diffusers':
+    model = load_model(JOB_MODEL, model_id=JOB_MODEL_ID, prompt=JOB_PROMPT, strength=JOB_STRENGTH,
+                       guidance_scale=JOB_GUIDANCE_SCALE, steps=JOB_STEPS, size=JOB_SIZE, seed=JOB_SEED)
+else:
+    model = load_model(JOB_MODEL)
+# Workers (and the model load) start with the first submission, so importing
+# serv.py or the debug reloader's parent process never loads the model
+job_queue = JobQueue(model, artifact_store, max_queue=JOB_QUEUE_SIZE, max_batch=JOB_MAX_BATCH,
+                     max_wait_s=JOB_MAX_WAIT_MS / 1000.0, workers=JOB_WORKERS)
+
+# Rendered pages: template name -> ([(path, (mtime_ns, size)), ...] it was built from, bodies)
+rendered_pages = {}
+
+def static_path(filename):
+    path = safe_join(STATIC_ROOT, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    artifact_store.lookup(filename)  # keeps served artifacts recently used
+    return path
+
+def file_key(path):
+    st = os.stat(path)
+    return st.st_mtime_ns, st.st_size
+
+def page_dependency(path):
+    # Files a cached page embeds URLs for; any change re-renders the page
+    deps = g.get('page_deps')
+    if deps is not None:
+        deps.add(path)
+
+@app.context_processor
+def asset_helpers():
+    # {{ asset_url(name) }} for fingerprinted static files;
+    # {{ image_url(name) }} / {{ image_srcset(name) }} for <img src> and srcset
+    def asset_url(filename):
+        page_dependency(static_path(filename))
+        return static_assets.url(filename)
+
+    def image_url(filename, width=IMAGE_DEFAULT_WIDTH):
+        path = static_path(filename)
+        page_dependency(path)
+        return url_for('image_variant', filename=filename, w=width, v=image_cache.source_hash(path)[:16])
+
+    def image_srcset(filename):
+        widths = image_cache.srcset_widths(static_path(filename))
+        return ', '.join('%s %dw' % (image_url(filename, w), w) for w in widths)
+
+    return {'asset_url': asset_url, 'image_url': image_url, 'image_srcset': image_srcset}
+
+def render_cached(template):
+    # Renders once and keeps the HTML, gzip and brotli bodies until the template
+    # or a file it references changes
+    entry = rendered_pages.get(template)
+    if entry is not None and all(os.path.exists(p) and file_key(p) == key for p, key in entry[0]):
+        return entry[1]
+    g.page_deps = {os.path.join(app.root_path, app.template_folder, template)}
+    html = render_template(template).encode('utf-8')
+    deps = [(p, file_key(p)) for p in g.pop('page_deps')]
+    bodies = compressed_bodies(html, hashlib.sha256(html).hexdigest()[:32])
+    rendered_pages[template] = (deps, bodies)
+    return bodies
+
+def serve_static(filename):
+    # Plain /static/ URLs: revalidate every time, 304 while unchanged
+    static_path(filename)
+    asset = static_assets.get(filename)
+    if asset is None:
+        abort(404)
+    return serve_asset(asset, REVALIDATE)
+
+app.add_url_rule('/static/<path:filename>', endpoint='static', view_func=serve_static)
+
+@app.route('/assets/<digest>/<path:filename>')
+def fingerprinted_asset(filename, digest):
+    # Immutable while the fingerprint matches; an outdated one gets the current file, revalidated
+    static_path(filename)
+    asset = static_assets.get(filename)
+    if asset is None:
+        abort(404)
+    return serve_asset(asset, IMMUTABLE if asset.digest.startswith(digest) else REVALIDATE)
+
+@app.route('/img/<path:filename>')
+def image_variant(filename):
+    # Resized variant of a static image: ?w= picks a width bucket, ?fmt=webp|jpeg,
+    # otherwise WebP when the browser accepts it and JPEG when it does not.
+    # ?v= is the source fingerprint written by image_url; while it matches,
+    # the response is immutable.
+    path = static_path(filename)
+    width = request.args.get('w', WIDTH_BUCKETS[-1], type=int)
+    fmt = request.args.get('fmt')
+    if fmt is None:
+        fmt = 'webp' if 'image/webp' in request.headers.get('Accept', '') else 'jpeg'
+    elif fmt not in FORMATS:
+        abort(400)
+    try:
+        variant, mimetype = image_cache.open_variant(path, width, fmt)
+    except FileNotFoundError:
+        abort(404)
+    except OSError:
+        abort(415)  # not an image PIL can read (css, js, svg, ...)
+    version = request.args.get('v')
+    fresh = version is not None and image_cache.source_hash(path).startswith(version)
+    etag = os.path.splitext(os.path.basename(variant.name))[0] + '-' + fmt
+    resp = respond({}, mimetype, IMMUTABLE if fresh else REVALIDATE, etag, variant)
+    if resp.status_code == 304:
+        variant.close()
+    if 'fmt' not in request.args:
+        resp.vary.add('Accept')
+    return resp
+
+def job_json(job):
+    def static_url(name):
+        if artifact_store.lookup(name) is None:
+            return None
+        return static_assets.url(name)
+
+    return {
+        'id': job.id,
+        'status': job.status,
+        'cached': job.cached,
+        'batch_size': job.batch_size,
+        'error': job.error,
+        'input_url': static_url(job.input_name),
+        'output_url': static_url(job.output_name) if job.status == 'done' else None,
+        'url': url_for('get_job', job_id=job.id),
+    }
+
+def job_response(job):
+    wait = min(request.args.get('wait', 0.0, type=float), JOB_MAX_WAIT_S)
+    if wait > 0:
+        job_queue.wait(job, wait)
+    if job.status in ('queued', 'running'):
+        return jsonify(job_json(job)), 202, {'Location': url_for('get_job', job_id=job.id)}
+    return jsonify(job_json(job))
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    # Upload as multipart field "image" or as the raw request body.
+    # ?wait=<s> holds the response until the job finishes (up to 30 s).
+    upload = request.files.get('image')
+    data = upload.read() if upload is not None else request.get_data()
+    if not data:
+        return jsonify({'error': 'no image uploaded'}), 400
+    job_queue.start()
+    try:
+        job = job_queue.submit(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except QueueFull:
+        return jsonify({'error': 'job queue is full'}), 429, {'Retry-After': '1'}
+    except ModelUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    return job_response(job)
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    return job_response(job)
+
+@app.route('/jobs')
+def job_stats():
+    return jsonify(dict(job_queue.get_stats(), store=artifact_store.get_stats()))
 
 @app.route('/')
 def home():
-    return render_template('index.html')  # 使用 render_template 查找 templates/index.html
+    # 使用 render_template 查找 templates/index.html
+    bodies = render_cached('index.html')
+    return respond(bodies, 'text/html', REVALIDATE)
 
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    app.run(host='0.0.0.0', port=5000, debug=True)
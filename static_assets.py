@@ -0,0 +1,133 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+from flask import Response, request, send_file
+
+try:
+    import brotli
+except ImportError:  # gzip only
+    brotli = None
+
+# Content-hashed static assets. Each file under the static root gets a strong
+# ETag from its SHA-256, a fingerprinted URL (/assets/<hash>/<path>) that can
+# be cached forever, and, when it is text-like, gzip and brotli bodies
+# compressed once and kept in memory. Files are hashed at startup and
+# re-hashed when their size or mtime changes.
+
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+MIN_COMPRESS_BYTES = 256
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+class Representation:
+    # One encoded body of a resource (identity, gzip or br) with its validator
+    def __init__(self, body, etag, encoding=None):
+        self.body = body
+        self.etag = etag
+        self.encoding = encoding
+
+class Asset:
+    def __init__(self, path, stat_key, digest, mimetype, bodies):
+        self.path = path
+        self.stat_key = stat_key
+        self.digest = digest
+        self.mimetype = mimetype
+        self.bodies = bodies  # encoding -> Representation; identity absent for large binaries
+
+def compressed_bodies(data, digest):
+    # Identity plus gzip/brotli where they actually save bytes
+    bodies = {"identity": Representation(data, digest)}
+    if len(data) < MIN_COMPRESS_BYTES:
+        return bodies
+    gz = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(gz) < len(data):
+        bodies["gzip"] = Representation(gz, digest + "-gz", "gzip")
+    if brotli is not None:
+        br = brotli.compress(data, quality=11)
+        if len(br) < len(data):
+            bodies["br"] = Representation(br, digest + "-br", "br")
+    return bodies
+
+def is_compressible(mimetype):
+    return any(mimetype.startswith(t) for t in COMPRESSIBLE_TYPES)
+
+class StaticAssets:
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}
+        self.lock = threading.Lock()
+        for dirpath, _, names in os.walk(root):
+            for name in names:
+                self.get(os.path.relpath(os.path.join(dirpath, name), root).replace(os.sep, "/"))
+
+    def get(self, filename):
+        # Asset for a path relative to the root, or None if there is no such file
+        path = os.path.join(self.root, filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            with self.lock:
+                self.assets.pop(filename, None)
+            return None
+        stat_key = (st.st_mtime_ns, st.st_size)
+        asset = self.assets.get(filename)
+        if asset is not None and asset.stat_key == stat_key:
+            return asset
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        bodies = compressed_bodies(data, digest) if is_compressible(mimetype) else {}
+        asset = Asset(path, stat_key, digest, mimetype, bodies)
+        with self.lock:
+            self.assets[filename] = asset
+        return asset
+
+    def url(self, filename):
+        asset = self.get(filename)
+        if asset is None:
+            return "/static/" + filename
+        return "/assets/%s/%s" % (asset.digest[:16], filename)
+
+def choose_encoding(bodies):
+    accepted = request.accept_encodings
+    for encoding in ("br", "gzip"):
+        if encoding in bodies and accepted[encoding]:
+            return encoding
+    return "identity"
+
+def not_modified(etags, cache_control):
+    resp = Response(status=304)
+    resp.set_etag(etags[0])
+    resp.headers["Cache-Control"] = cache_control
+    return resp
+
+def respond(bodies, mimetype, cache_control, etag=None, path=None):
+    # 304 if the client holds any representation of the same content, else
+    # the best encoding it accepts. With no in-memory bodies the file at
+    # `path` (a file name or an open binary file) is streamed as is,
+    # validated by `etag`.
+    if bodies:
+        rep = bodies[choose_encoding(bodies)]
+        etags = [rep.etag] + [b.etag for b in bodies.values() if b is not rep]
+    else:
+        rep = None
+        etags = [etag]
+    if any(request.if_none_match.contains_weak(tag) for tag in etags):
+        return not_modified(etags, cache_control)
+    if rep is None:
+        resp = send_file(path, mimetype=mimetype, conditional=False, etag=False)
+    else:
+        resp = Response(rep.body, mimetype=mimetype)
+        if rep.encoding:
+            resp.headers["Content-Encoding"] = rep.encoding
+        if len(bodies) > 1:
+            resp.vary.add("Accept-Encoding")
+    resp.set_etag(etags[0])
+    resp.headers["Cache-Control"] = cache_control
+    return resp
+
+def serve_asset(asset, cache_control):
+    return respond(asset.bodies, asset.mimetype, cache_control, asset.digest, asset.path)